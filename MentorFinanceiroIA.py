@@ -5,13 +5,50 @@
 # Importação das bibliotecas necessárias
 import streamlit as st  # Biblioteca para criação de interface web
 import google.generativeai as genai  # API do Google Generative AI (Gemini)
+from streamlit.runtime.scriptrunner import get_script_run_ctx  # Para identificar a sessão atual
 import os  # Para manipulação de variáveis de ambiente
+import json  # Para serializar prompts e dados persistidos
+import gzip  # Para compactar as sessões gravadas em disco
+import hashlib  # Para gerar chaves de cache a partir dos prompts
+import sqlite3  # Para o cache de respostas compartilhado entre processos
+import threading  # Para coordenar chamadas à IA feitas em segundo plano
+import base64  # Para embutir o gráfico nos relatórios em Markdown/HTML
+import html  # Para escapar textos no relatório em HTML
+import textwrap  # Para quebrar linhas no relatório em PDF
+import uuid  # Para nomear os arquivos de relatório
+from io import BytesIO  # Para gerar imagens em memória
 import time  # Para pausas e simulação de processamento
 import pandas as pd  # Para manipulação de dados
 import matplotlib.pyplot as plt  # Para visualização de dados
+import matplotlib.image as mpimg  # Para reaproveitar a imagem do gráfico no PDF
+from matplotlib.figure import Figure  # Figuras sem o estado global do pyplot (seguras fora da thread do script)
+from matplotlib.backends.backend_pdf import PdfPages  # Para exportar o relatório em PDF
 import numpy as np  # Para operações numéricas
 import random  # Para geração de desafios aleatórios
-from datetime import datetime, timedelta  # Para manipulação de datas
+import heapq  # Para a agenda de expiração dos desafios
+import unicodedata  # Para normalizar acentos em textos
+import re  # Para separar palavras na busca dos planejamentos
+import math  # Para a pontuação (BM25) da busca nos planejamentos
+from datetime import date, datetime, timedelta  # Para manipulação de datas
+from itertools import islice  # Para fatiar dicionários sem copiá-los inteiros
+from bisect import bisect_left  # Para o autocompletar do glossário
+from contextlib import closing, contextmanager  # Para fechar conexões com o banco automaticamente
+from collections import OrderedDict  # Para ordenar as sessões pelo último acesso
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as PrazoEsgotado  # Para chamadas à IA com prazo
+
+# Diretório para dados compartilhados entre os processos do servidor (cache, históricos...)
+DIRETORIO_DADOS = os.environ.get("MENTOR_DADOS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mentor_dados"))
+
+def remover_arquivos_expirados(diretorio, validade_segundos, agora=None):
+    # Apaga os arquivos do diretório que não são modificados há mais de validade_segundos
+    limite = (agora or time.time()) - validade_segundos
+    try: nomes_arquivos = os.listdir(diretorio)
+    except OSError: return
+    for nome_arquivo in nomes_arquivos:
+        caminho = os.path.join(diretorio, nome_arquivo)
+        try:
+            if os.path.getmtime(caminho) < limite: os.remove(caminho)
+        except OSError: pass
 
 # Configuração da página Streamlit
 st.set_page_config(
@@ -158,6 +195,8 @@ def configurar_api_key():
         return False
 
 # --- Configuração do Modelo Generativo ---
+MODELO_GEMINI = "gemini-1.5-flash"
+
 def configurar_modelo_gemini():
     if not configurar_api_key():
         return None
@@ -178,7 +217,7 @@ def configurar_modelo_gemini():
     
     try:
         model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash", # Modelo atualizado
+            model_name=MODELO_GEMINI, # Modelo atualizado
             generation_config=generation_config,
             safety_settings=safety_settings
         )
@@ -187,6 +226,448 @@ def configurar_modelo_gemini():
         st.error(f"❌ Erro ao inicializar o modelo Gemini: {e}")
         return None
 
+# --- Cache Compartilhado de Respostas da IA ---
+class CacheRespostasLLM:
+    """
+    Cache de respostas do Gemini em SQLite, compartilhado por todos os processos do servidor na mesma máquina.
+    Cada gravação é uma transação (atômica); entradas têm validade própria (TTL) e, quando o
+    tamanho total passa do limite, as menos acessadas recentemente são removidas.
+    """
+    def __init__(self, caminho, tamanho_maximo_bytes):
+        self.caminho = caminho
+        self.tamanho_maximo_bytes = tamanho_maximo_bytes
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.execute("PRAGMA journal_mode=WAL") # Leitores não bloqueiam o processo que está gravando
+            conexao.execute("""CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY, valor TEXT NOT NULL, tamanho INTEGER NOT NULL,
+                expira_em REAL NOT NULL, ultimo_acesso REAL NOT NULL)""")
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_respostas_expira_em ON respostas (expira_em)")
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_respostas_ultimo_acesso ON respostas (ultimo_acesso)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.caminho, timeout=10)
+
+    def obter(self, chave):
+        agora = time.time()
+        with closing(self._conectar()) as conexao, conexao:
+            linha = conexao.execute("SELECT valor, expira_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None: return None
+            if linha[1] <= agora:
+                conexao.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                return None
+            conexao.execute("UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (agora, chave))
+            return linha[0]
+
+    def gravar(self, chave, valor, ttl_segundos):
+        agora = time.time()
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.execute("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?)",
+                            (chave, valor, len(valor.encode("utf-8")), agora + ttl_segundos, agora))
+            conexao.execute("DELETE FROM respostas WHERE expira_em <= ?", (agora,))
+            # Mantém as entradas acessadas mais recentemente até o limite de tamanho
+            conexao.execute("""DELETE FROM respostas WHERE chave IN (
+                SELECT chave FROM (SELECT chave, SUM(tamanho) OVER (ORDER BY ultimo_acesso DESC, chave) AS acumulado FROM respostas)
+                WHERE acumulado > ?)""", (self.tamanho_maximo_bytes,))
+
+@st.cache_resource
+def obter_cache_respostas():
+    tamanho_maximo_mb = float(os.environ.get("MENTOR_CACHE_MAX_MB", "50"))
+    return CacheRespostasLLM(os.path.join(DIRETORIO_DADOS, "cache_respostas.sqlite3"), int(tamanho_maximo_mb * 1024 * 1024))
+
+# Validade das respostas em cache por tipo de conteúdo
+TTL_GLOSSARIO = 30 * 24 * 3600
+TTL_DICA = 24 * 3600
+TTL_PERSONALIZADO = 3600
+
+def chave_prompt(prompt):
+    return hashlib.sha256(json.dumps([MODELO_GEMINI, prompt], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def consultar_cache(chave):
+    try: return obter_cache_respostas().obter(chave)
+    except sqlite3.Error: return None # Problemas no cache nunca impedem a resposta
+
+def chamar_modelo_e_gravar(modelo, prompt, chave, ttl_segundos):
+    texto = consultar_cache(chave) # Uma chamada idêntica pode ter terminado logo antes desta começar
+    if texto is not None: return texto
+    texto = modelo.generate_content(prompt).text
+    try: obter_cache_respostas().gravar(chave, texto, ttl_segundos)
+    except sqlite3.Error: pass
+    return texto
+
+def gerar_conteudo(modelo, prompt, ttl_segundos):
+    """
+    Chama modelo.generate_content reaproveitando respostas de qualquer processo para o mesmo prompt.
+    Pedidos idênticos feitos ao mesmo tempo compartilham uma única chamada à API.
+    """
+    chave = chave_prompt(prompt)
+    texto = consultar_cache(chave)
+    if texto is not None: return texto
+    return obter_chamadas_em_andamento().executar(chave, lambda: chamar_modelo_e_gravar(modelo, prompt, chave, ttl_segundos))
+
+# --- Prazos de Resposta da IA ---
+# Recursos que aparecem sem o usuário pedir (dica do dashboard) ou que ele espera
+# na hora (glossário) têm um prazo máximo. Esgotado o prazo, a página responde com
+# conteúdo local e a chamada segue em segundo plano, gravando no cache para o próximo rerun.
+PRAZOS_RESPOSTA_SEGUNDOS = {
+    "dica": float(os.environ.get("MENTOR_PRAZO_DICA", "2.5")),
+    "glossario": float(os.environ.get("MENTOR_PRAZO_GLOSSARIO", "4")),
+}
+
+class ChamadasEmAndamento:
+    """
+    Registro das chamadas à IA em andamento por chave de prompt: pedidos idênticos esperam o mesmo Future.
+    Quem chega primeiro faz a chamada na própria thread da sessão (executar), como antes, sem fila;
+    só os recursos com prazo usam o pool, que é deles e não disputa vaga com planejamentos longos.
+    """
+    def __init__(self, max_threads_com_prazo):
+        self.executor = ThreadPoolExecutor(max_workers=max_threads_com_prazo, thread_name_prefix="mentor-ia")
+        self.trava = threading.Lock()
+        self.em_andamento = {}
+
+    def _registrar(self, chave):
+        # (futuro, True) para quem deve fazer a chamada; (futuro, False) para quem só espera por ela
+        with self.trava:
+            futuro = self.em_andamento.get(chave)
+            if futuro is not None: return futuro, False
+            futuro = self.em_andamento[chave] = Future()
+            return futuro, True
+
+    def _chamar(self, chave, futuro, funcao):
+        try: resultado = funcao()
+        except BaseException as erro:
+            self._finalizar(chave, futuro); futuro.set_exception(erro)
+            if not isinstance(erro, Exception): raise
+        else: self._finalizar(chave, futuro); futuro.set_result(resultado)
+
+    def _finalizar(self, chave, futuro):
+        with self.trava:
+            if self.em_andamento.get(chave) is futuro: del self.em_andamento[chave]
+
+    def executar(self, chave, funcao):
+        futuro, primeiro = self._registrar(chave)
+        if primeiro: self._chamar(chave, futuro, funcao)
+        return futuro.result()
+
+    def iniciar_em_segundo_plano(self, chave, funcao):
+        futuro, primeiro = self._registrar(chave)
+        if primeiro: self.executor.submit(self._chamar, chave, futuro, funcao)
+        return futuro, primeiro
+
+@st.cache_resource
+def obter_chamadas_em_andamento():
+    return ChamadasEmAndamento(int(os.environ.get("MENTOR_THREADS_IA", "8")))
+
+# --- Envios Idempotentes ---
+# Um clique duplo (ou um rerun no meio do processamento) reenvia o mesmo botão.
+# Cada envio tem uma chave; repetições dentro da janela reaproveitam o resultado
+# anterior sem chamar a IA, registrar histórico ou dar pontos de novo.
+JANELA_IDEMPOTENCIA_SEGUNDOS = 30
+
+def chave_idempotencia(acao, *conteudo):
+    return hashlib.sha256(json.dumps([acao, *conteudo], ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def obter_envio_recente(chave):
+    envio = st.session_state.envios_recentes.get(chave)
+    if envio and time.time() - envio[0] <= JANELA_IDEMPOTENCIA_SEGUNDOS: return envio[1]
+    return None
+
+def registrar_envio(chave, resultado):
+    agora = time.time()
+    envios = st.session_state.envios_recentes
+    for chave_antiga in [c for c, (instante, _) in envios.items() if agora - instante > JANELA_IDEMPOTENCIA_SEGUNDOS]:
+        del envios[chave_antiga]
+    envios[chave] = (agora, resultado)
+
+def gerar_conteudo_com_prazo(modelo, prompt, ttl_segundos, prazo_segundos):
+    """
+    Como gerar_conteudo, mas retorna (texto, futuro). Se a resposta não ficar pronta dentro do prazo,
+    o texto é None e o futuro da chamada, que segue em segundo plano, permite acompanhá-la.
+    Se a mesma chamada já estava em andamento, o prazo já foi gasto por quem a iniciou: não espera de novo.
+    """
+    chave = chave_prompt(prompt)
+    texto = consultar_cache(chave)
+    if texto is not None: return texto, None
+    futuro, primeiro = obter_chamadas_em_andamento().iniciar_em_segundo_plano(chave, lambda: chamar_modelo_e_gravar(modelo, prompt, chave, ttl_segundos))
+    if not primeiro and not futuro.done(): return None, futuro
+    try: return futuro.result(timeout=prazo_segundos), futuro # Erros da API chegam a quem chamou
+    except PrazoEsgotado: return None, futuro
+
+# --- Modelo de Dados ---
+# Registros com __slots__ (sem __dict__ por instância) para dívidas, metas e desafios.
+# serializar() gera uma tupla compacta para persistência; desserializar() faz o caminho inverso.
+class Divida:
+    """Dívida cadastrada no diagnóstico. Valores em R$ e juros em % ao mês."""
+    __slots__ = ("valor_total", "parcela_mensal", "taxa_juros_mensal", "total_parcelas")
+
+    def __init__(self, valor_total, parcela_mensal=0.0, taxa_juros_mensal=0.0, total_parcelas=None):
+        self.valor_total = float(valor_total)
+        self.parcela_mensal = float(parcela_mensal or 0)
+        self.taxa_juros_mensal = float(taxa_juros_mensal or 0)
+        self.total_parcelas = int(total_parcelas) if total_parcelas else None
+
+    def simular_quitacao(self, limite_meses=600):
+        # Paga só a parcela atual todo mês; tempo infinito se a parcela não cobre os juros
+        if self.parcela_mensal <= 0: return None
+        taxa = self.taxa_juros_mensal / 100
+        saldo_devedor = self.valor_total; meses = 0; total_pago = 0; total_juros = 0
+        while saldo_devedor > 0.01 and meses < limite_meses: # Limite e condição de parada
+            meses += 1; juros_mes = saldo_devedor * taxa; total_juros += juros_mes
+            if self.parcela_mensal - juros_mes <= 0: meses = float('inf'); break # Parcela não cobre juros
+            pagamento_efetivo = min(self.parcela_mensal, saldo_devedor + juros_mes)
+            total_pago += pagamento_efetivo
+            saldo_devedor += juros_mes - pagamento_efetivo
+        return {"tempo_meses": meses, "total_pago": total_pago, "total_juros": total_juros}
+
+    def serializar(self):
+        return (self.valor_total, self.parcela_mensal, self.taxa_juros_mensal, self.total_parcelas)
+
+    @classmethod
+    def desserializar(cls, dados):
+        return cls(*dados)
+
+class Meta:
+    """Meta financeira com valor, prazo em meses a partir da criação e prioridade (Alta, Média, Baixa)."""
+    __slots__ = ("valor", "prazo_meses", "prioridade", "criada_em")
+
+    def __init__(self, valor, prazo_meses, prioridade="Média", criada_em=None):
+        self.valor = float(valor)
+        self.prazo_meses = int(prazo_meses)
+        self.prioridade = prioridade
+        self.criada_em = criada_em or date.today()
+
+    @property
+    def valor_mensal_necessario(self):
+        return self.valor / self.prazo_meses
+
+    @property
+    def data_criacao(self):
+        return self.criada_em.strftime("%d/%m/%Y")
+
+    def meses_restantes(self, hoje):
+        decorridos = (hoje.year - self.criada_em.year) * 12 + hoje.month - self.criada_em.month
+        return max(1, self.prazo_meses - decorridos)
+
+    def serializar(self):
+        return (self.valor, self.prazo_meses, self.prioridade, self.criada_em.toordinal())
+
+    @classmethod
+    def desserializar(cls, dados):
+        valor, prazo_meses, prioridade, criada_em = dados
+        return cls(valor, prazo_meses, prioridade, date.fromordinal(criada_em))
+
+class DefinicaoDesafio:
+    """Entrada do catálogo de desafios; uma única instância é compartilhada por todas as sessões."""
+    __slots__ = ("titulo", "descricao", "dificuldade", "pontos", "duracao_dias", "tags")
+
+    def __init__(self, titulo, descricao, dificuldade, pontos, duracao_dias, tags=()):
+        self.titulo = titulo
+        self.descricao = descricao
+        self.dificuldade = dificuldade
+        self.pontos = pontos
+        self.duracao_dias = duracao_dias
+        self.tags = tuple(tags)
+
+class Desafio:
+    """Desafio de um usuário: referencia a definição do catálogo e guarda só as próprias datas."""
+    __slots__ = ("definicao", "data_inicio", "data_fim", "data_conclusao")
+
+    def __init__(self, definicao, data_inicio=None, data_fim=None, data_conclusao=None):
+        self.definicao = definicao
+        self.data_inicio = data_inicio or datetime.now()
+        self.data_fim = data_fim or self.data_inicio + timedelta(days=definicao.duracao_dias)
+        self.data_conclusao = data_conclusao
+
+    titulo = property(lambda self: self.definicao.titulo)
+    descricao = property(lambda self: self.definicao.descricao)
+    dificuldade = property(lambda self: self.definicao.dificuldade)
+    pontos = property(lambda self: self.definicao.pontos)
+    duracao_dias = property(lambda self: self.definicao.duracao_dias)
+
+    @property
+    def concluido(self):
+        return self.data_conclusao is not None
+
+    def dias_restantes(self, agora=None):
+        return max(0, (self.data_fim - (agora or datetime.now())).days)
+
+    def concluir(self, agora=None):
+        self.data_conclusao = agora or datetime.now()
+
+    def serializar(self):
+        # O título identifica a definição no catálogo; datas viram timestamps
+        return (self.titulo, self.data_inicio.timestamp(), self.data_fim.timestamp(),
+                self.data_conclusao.timestamp() if self.data_conclusao else None)
+
+    @classmethod
+    def desserializar(cls, dados, catalogo):
+        titulo, inicio, fim, conclusao = dados
+        definicao = catalogo.por_titulo.get(titulo)
+        if definicao is None: return None # Desafio removido do catálogo
+        return cls(definicao, datetime.fromtimestamp(inicio), datetime.fromtimestamp(fim),
+                   datetime.fromtimestamp(conclusao) if conclusao is not None else None)
+
+def serializar_dados_financeiros(dados):
+    return {**dados,
+            "dividas": {nome: divida.serializar() for nome, divida in dados["dividas"].items()},
+            "metas": {nome: meta.serializar() for nome, meta in dados["metas"].items()}}
+
+def desserializar_dados_financeiros(dados):
+    return {**dados,
+            "dividas": {nome: Divida.desserializar(divida) for nome, divida in dados["dividas"].items()},
+            "metas": {nome: Meta.desserializar(meta) for nome, meta in dados["metas"].items()}}
+
+# --- Sessões Ociosas em Disco ---
+# Sessões sem interação há mais de TEMPO_SESSAO_OCIOSA_SEGUNDOS, ou além das MAX_SESSOES_RESIDENTES
+# usadas mais recentemente, têm os dados pesados gravados em um arquivo compacto (JSON + gzip) e
+# removidos da memória. No próximo rerun, a própria sessão recarrega o arquivo antes de tudo.
+TEMPO_SESSAO_OCIOSA_SEGUNDOS = float(os.environ.get("MENTOR_SESSAO_OCIOSA_MIN", "30")) * 60
+MAX_SESSOES_RESIDENTES = int(os.environ.get("MENTOR_MAX_SESSOES_RESIDENTES", "200"))
+VALIDADE_SESSOES_EM_DISCO_SEGUNDOS = 7 * 24 * 3600 # Arquivos de quem nunca voltou
+
+def _serializar_progresso_conquistas(progresso):
+    serializado = {}
+    for id_regra, estado in progresso.items():
+        estado = dict(estado)
+        if "vistos" in estado: estado["vistos"] = sorted(estado["vistos"])
+        if estado.get("inicio"): estado["inicio"] = estado["inicio"].timestamp()
+        serializado[id_regra] = estado
+    return serializado
+
+def _desserializar_progresso_conquistas(progresso):
+    for estado in progresso.values():
+        if "vistos" in estado: estado["vistos"] = set(estado["vistos"])
+        if estado.get("inicio"): estado["inicio"] = datetime.fromtimestamp(estado["inicio"])
+    return progresso
+
+def _desserializar_desafios(desafios):
+    catalogo = carregar_catalogo_desafios()
+    return [d for d in (Desafio.desserializar(dados, catalogo) for dados in desafios) if d is not None]
+
+# Chave da sessão -> (serializar, desserializar). O que não está aqui é pequeno e fica na memória;
+# agenda_desafios e envios_recentes são descartados e recriados por inicializar_sessao().
+CHAVES_SESSAO_EM_DISCO = {
+    "dados_financeiros": (serializar_dados_financeiros, desserializar_dados_financeiros),
+    "historico_consultas": (lambda h: [(c["data"].timestamp(), c["preocupacao"], c["planejamento"]) for c in h],
+                            lambda h: [{"data": datetime.fromtimestamp(d), "preocupacao": p, "planejamento": t} for d, p, t in h]),
+    "indice_planejamentos": (lambda i: i.serializar(), lambda i: IndicePlanejamentos.desserializar(i)),
+    "conquistas": (list, list),
+    "progresso_conquistas": (_serializar_progresso_conquistas, _desserializar_progresso_conquistas),
+    "desafios_ativos": (lambda ds: [d.serializar() for d in ds], _desserializar_desafios),
+    "desafios_concluidos": (lambda ds: [d.serializar() for d in ds], _desserializar_desafios),
+    "desafio_proposto": (lambda d: d and d.serializar(), lambda d: d and Desafio.desserializar(d, carregar_catalogo_desafios())),
+}
+CHAVES_SESSAO_DESCARTAVEIS = ("agenda_desafios", "envios_recentes")
+
+class RegistroSessao:
+    __slots__ = ("estado", "trava", "ultimo_acesso", "em_execucao")
+
+    def __init__(self):
+        self.estado = None # Estado da sessão (thread-safe) da última execução do script
+        self.trava = threading.Lock()
+        self.ultimo_acesso = time.time()
+        self.em_execucao = 0 # Execuções em andamento: o script inteiro e, dentro dele ou sozinhos, fragmentos
+
+class GerenciadorSessoesOciosas:
+    """
+    Guarda as sessões residentes da menos para a mais recentemente usada. Cada execução do script
+    marca a sessão como em uso; o despejo das ociosas roda em uma thread própria, fora do caminho
+    das páginas, e nunca mexe em uma sessão em execução.
+    """
+    def __init__(self, diretorio, tempo_ocioso, max_residentes):
+        self.diretorio = diretorio
+        self.tempo_ocioso = tempo_ocioso
+        self.max_residentes = max_residentes
+        self.sessoes = OrderedDict()
+        self.trava = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mentor-sessoes")
+        self.despejo_pendente = False
+        self.ultima_limpeza = 0.0
+        os.makedirs(diretorio, exist_ok=True)
+
+    def iniciar_execucao(self, id_sessao, estado):
+        with self.trava:
+            registro = self.sessoes.pop(id_sessao, None) or RegistroSessao()
+            self.sessoes[id_sessao] = registro # Vai para o fim: a mais recente
+            mais_antiga = next(iter(self.sessoes.values()))
+            agendar = not self.despejo_pendente and (len(self.sessoes) > self.max_residentes or
+                                                     time.time() - mais_antiga.ultimo_acesso >= self.tempo_ocioso)
+            if agendar: self.despejo_pendente = True
+        with registro.trava: # Espera um despejo desta sessão que esteja em andamento
+            registro.estado = estado; registro.em_execucao += 1
+        if agendar: self.executor.submit(self.despejar_ociosas)
+
+    def finalizar_execucao(self, id_sessao):
+        registro = self.sessoes.get(id_sessao)
+        if registro: registro.em_execucao = max(registro.em_execucao - 1, 0); registro.ultimo_acesso = time.time()
+
+    def despejar_ociosas(self):
+        try:
+            agora = time.time()
+            with self.trava:
+                excedentes = len(self.sessoes) - self.max_residentes; vitimas = []
+                for id_sessao, registro in self.sessoes.items():
+                    if excedentes <= 0 and agora - registro.ultimo_acesso < self.tempo_ocioso: break
+                    if not registro.em_execucao: vitimas.append((id_sessao, registro))
+                    excedentes -= 1
+            for id_sessao, registro in vitimas:
+                with registro.trava:
+                    if registro.em_execucao or not self.gravar(id_sessao, registro.estado): continue
+                with self.trava: # Sai da lista, a menos que a sessão tenha voltado nesse meio-tempo
+                    if self.sessoes.get(id_sessao) is registro and not registro.em_execucao: del self.sessoes[id_sessao]
+            if agora - self.ultima_limpeza > 3600: self.remover_arquivos_antigos(agora)
+        finally:
+            self.despejo_pendente = False
+
+    def gravar(self, id_sessao, estado):
+        if estado is None or "sessao_em_disco" in estado and estado["sessao_em_disco"]: return True
+        caminho = os.path.join(self.diretorio, f"{id_sessao}.json.gz")
+        conteudo = {chave: serializar(estado[chave]) for chave, (serializar, _) in CHAVES_SESSAO_EM_DISCO.items() if chave in estado}
+        try:
+            with gzip.open(caminho + ".parcial", "wt", encoding="utf-8") as arquivo:
+                json.dump(conteudo, arquivo, ensure_ascii=False, separators=(",", ":"))
+            os.replace(caminho + ".parcial", caminho)
+        except OSError: return False # Sem disco: a sessão continua na memória
+        for chave in (*conteudo, *CHAVES_SESSAO_DESCARTAVEIS):
+            if chave in estado: del estado[chave]
+        estado["sessao_em_disco"] = caminho
+        return True
+
+    def remover_arquivos_antigos(self, agora):
+        self.ultima_limpeza = agora
+        remover_arquivos_expirados(self.diretorio, VALIDADE_SESSOES_EM_DISCO_SEGUNDOS, agora)
+        # O histórico de saúde é da sessão: passado o prazo em que ela poderia voltar, ninguém mais o lê
+        remover_arquivos_expirados(os.path.join(DIRETORIO_DADOS, "historico_saude"), VALIDADE_SESSOES_EM_DISCO_SEGUNDOS, agora)
+
+@st.cache_resource
+def obter_gerenciador_sessoes():
+    return GerenciadorSessoesOciosas(os.path.join(DIRETORIO_DADOS, "sessoes"), TEMPO_SESSAO_OCIOSA_SEGUNDOS, MAX_SESSOES_RESIDENTES)
+
+@contextmanager
+def sessao_em_uso():
+    # Marca a sessão como em uso enquanto o script (ou só um fragmento) roda, para não ser despejada no meio
+    contexto = get_script_run_ctx()
+    gerenciador = obter_gerenciador_sessoes()
+    if contexto: gerenciador.iniciar_execucao(contexto.session_id, contexto.session_state)
+    try: yield
+    finally:
+        if contexto: gerenciador.finalizar_execucao(contexto.session_id)
+
+def reidratar_sessao():
+    # Traz de volta os dados de uma sessão despejada; roda antes de inicializar_sessao()
+    caminho = st.session_state.get("sessao_em_disco")
+    if not caminho: return
+    st.session_state.sessao_em_disco = None
+    try:
+        with gzip.open(caminho, "rt", encoding="utf-8") as arquivo: conteudo = json.load(arquivo)
+    except (OSError, ValueError):
+        st.warning("⚠️ Não foi possível recuperar os dados da sua sessão anterior. Vamos recomeçar!")
+        return
+    for chave, valor in conteudo.items():
+        st.session_state[chave] = CHAVES_SESSAO_EM_DISCO[chave][1](valor)
+    try: os.remove(caminho)
+    except OSError: pass
+
 # --- Inicialização da Sessão ---
 def inicializar_sessao():
     if 'nome_usuario' not in st.session_state:
@@ -201,6 +682,12 @@ def inicializar_sessao():
             'metas': {}
         }
     
+    if 'contribuiu_coorte' not in st.session_state:
+        st.session_state.contribuiu_coorte = False
+
+    if 'id_historico_saude' not in st.session_state:
+        st.session_state.id_historico_saude = uuid.uuid4().hex # Identifica o histórico de saúde desta sessão
+
     if 'pontos' not in st.session_state:
         st.session_state.pontos = 0
     
@@ -209,13 +696,23 @@ def inicializar_sessao():
     
     if 'conquistas' not in st.session_state:
         st.session_state.conquistas = []
+
+    if 'progresso_conquistas' not in st.session_state:
+        st.session_state.progresso_conquistas = {}
     
     if 'desafios_ativos' not in st.session_state:
         st.session_state.desafios_ativos = []
     
+    if 'agenda_desafios' not in st.session_state:
+        st.session_state.agenda_desafios = [(d.data_fim, d.titulo) for d in st.session_state.desafios_ativos]
+        heapq.heapify(st.session_state.agenda_desafios)
+
     if 'desafios_concluidos' not in st.session_state:
         st.session_state.desafios_concluidos = []
 
+    if 'total_desafios_concluidos' not in st.session_state:
+        st.session_state.total_desafios_concluidos = len(st.session_state.desafios_concluidos)
+
     # NOVA VARIÁVEL DE SESSÃO para o desafio proposto mas ainda não aceito
     if 'desafio_proposto' not in st.session_state:
         st.session_state.desafio_proposto = None
@@ -225,6 +722,22 @@ def inicializar_sessao():
     
     if 'historico_consultas' not in st.session_state:
         st.session_state.historico_consultas = []
+
+    # Recriado a partir do histórico se faltar ou estiver defasado (ex.: sessão gravada antes do índice existir)
+    if st.session_state.get('indice_planejamentos') is None or len(st.session_state.indice_planejamentos.tamanhos) != len(st.session_state.historico_consultas):
+        st.session_state.indice_planejamentos = indexar_historico(st.session_state.historico_consultas)
+
+    if 'glossario_pendente' not in st.session_state:
+        st.session_state.glossario_pendente = None
+
+    if 'envios_recentes' not in st.session_state:
+        st.session_state.envios_recentes = {}
+
+    if 'versoes_tabelas' not in st.session_state:
+        st.session_state.versoes_tabelas = {} # Lista -> versão da tabela selecionável (ver exibir_tabela_selecionavel)
+
+    if 'relatorio' not in st.session_state:
+        st.session_state.relatorio = None
     
     if 'diagnostico_realizado' not in st.session_state:
         st.session_state.diagnostico_realizado = False
@@ -236,96 +749,314 @@ def adicionar_pontos(quantidade, motivo=""):
     st.session_state.nivel = 1 + (st.session_state.pontos // 100)
     
     if st.session_state.nivel > nivel_anterior:
-        adicionar_conquista(f"Nível {st.session_state.nivel} Alcançado! 🏆")
         st.balloons()
     
     if motivo:
         st.success(f"🎉 +{quantidade} pontos: {motivo}")
+    registrar_evento("pontos_ganhos", pontos=st.session_state.pontos, nivel=st.session_state.nivel)
 
 def adicionar_conquista(conquista):
     if conquista not in st.session_state.conquistas:
         st.session_state.conquistas.append(conquista)
         st.success(f"🏆 Nova conquista desbloqueada: {conquista}")
 
+# --- Motor de Conquistas ---
+# Regras declarativas: cada uma escuta um tipo de evento e mantém seu próprio
+# contador em st.session_state.progresso_conquistas.
+#   tipo "contagem": conta os eventos que passam no filtro
+#   tipo "distintos": conta valores diferentes do campo indicado
+#   tipo "maximo": guarda o maior valor já visto do campo indicado
+#   tipo "sequencia_dias": dias seguidos em que o filtro se manteve verdadeiro
+# Regras com "passo" se repetem: ao desbloquear, a meta avança e o título é formatado com o valor atingido.
+REGRAS_CONQUISTAS = [
+    {"id": "inicio_jornada", "evento": "jornada_iniciada", "tipo": "contagem", "meta": 1,
+     "titulo": "Início da Jornada Financeira! 🚀", "pontos": 10, "motivo": "Iniciou sua jornada financeira"},
+    {"id": "diagnostico_completo", "evento": "diagnostico_concluido", "tipo": "contagem", "meta": 1,
+     "titulo": "Diagnóstico Completo! 📊", "pontos": 30, "motivo": "Completou o diagnóstico financeiro"},
+    {"id": "primeira_meta", "evento": "meta_criada", "tipo": "contagem", "meta": 1,
+     "titulo": "Primeira Meta Definida! 🎯", "pontos": 15, "motivo": "Definiu sua primeira meta financeira"},
+    {"id": "niveis", "evento": "pontos_ganhos", "tipo": "maximo", "campo": "nivel", "meta": 2, "passo": 1,
+     "titulo": "Nível {valor} Alcançado! 🏆"},
+    {"id": "primeiro_desafio", "evento": "desafio_concluido", "tipo": "contagem", "meta": 1,
+     "titulo": "Primeiro Desafio Concluído! 🌟"},
+    {"id": "cinco_desafios", "evento": "desafio_concluido", "tipo": "contagem", "meta": 5,
+     "titulo": "Desafiador Experiente: 5 Desafios Concluídos! 🔥"},
+    {"id": "dez_desafios", "evento": "desafio_concluido", "tipo": "contagem", "meta": 10,
+     "titulo": "Mestre dos Desafios: 10 Desafios Concluídos! 🏅"},
+    # Conquistas sugeridas na página de conquistas
+    {"id": "desafios_dificeis", "evento": "desafio_concluido", "tipo": "contagem", "meta": 3,
+     "filtro": lambda dados: dados.get("dificuldade") in ("Médio", "Difícil"),
+     "titulo": "Encara Tudo: 3 Desafios Médios ou Difíceis! 💪",
+     "sugestao": "Complete 3 desafios de dificuldade 'Média' ou 'Difícil' 🎯"},
+    {"id": "nivel_5", "evento": "pontos_ganhos", "tipo": "maximo", "campo": "nivel", "meta": 5,
+     "titulo": "Nível 5 Alcançado! 🏆", "sugestao": "Atinja o Nível 5 de experiência 🌟"},
+    {"id": "comprometimento_controlado", "evento": "saude_avaliada", "tipo": "sequencia_dias", "meta": 30,
+     "filtro": lambda dados: dados["comprometimento_renda"] < 60,
+     "titulo": "Renda sob Controle: 1 Mês Abaixo de 60%! 💰",
+     "sugestao": "Mantenha o comprometimento de renda abaixo de 60% por um mês 💰"},
+    {"id": "reserva_um_mes", "evento": "saude_avaliada", "tipo": "maximo", "campo": "reserva_emergencia", "meta": 1,
+     "titulo": "Colchão Financeiro: Reserva de 1 Mês! 🛡️",
+     "sugestao": "Construa uma reserva de emergência para 1 mês de despesas 🛡️"},
+    {"id": "cinco_termos", "evento": "termo_aprendido", "tipo": "distintos", "campo": "termo", "meta": 5,
+     "titulo": "Dicionário Ambulante: 5 Termos Aprendidos! 📚",
+     "sugestao": "Aprenda 5 novos termos no glossário financeiro 📚"},
+]
+
+# Índice evento -> regras, montado uma vez: cada evento só avalia as regras que o escutam
+REGRAS_POR_EVENTO = {}
+for _regra in REGRAS_CONQUISTAS:
+    REGRAS_POR_EVENTO.setdefault(_regra["evento"], []).append(_regra)
+
+def _atualizar_contagem(regra, estado, dados, agora):
+    estado["valor"] += 1
+
+def _atualizar_distintos(regra, estado, dados, agora):
+    estado.setdefault("vistos", set()).add(dados[regra["campo"]])
+    estado["valor"] = len(estado["vistos"])
+
+def _atualizar_maximo(regra, estado, dados, agora):
+    estado["valor"] = max(estado["valor"], dados[regra["campo"]])
+
+def _atualizar_sequencia_dias(regra, estado, dados, agora):
+    if estado.get("inicio") is None: estado["inicio"] = agora
+    estado["valor"] = (agora - estado["inicio"]).days
+
+ATUALIZADORES_REGRAS = {
+    "contagem": _atualizar_contagem,
+    "distintos": _atualizar_distintos,
+    "maximo": _atualizar_maximo,
+    "sequencia_dias": _atualizar_sequencia_dias,
+}
+
+def obter_progresso_regra(regra):
+    progresso = st.session_state.progresso_conquistas
+    if regra["id"] not in progresso:
+        progresso[regra["id"]] = {"valor": 0, "meta": regra["meta"], "desbloqueada": False}
+    return progresso[regra["id"]]
+
+def registrar_evento(evento, **dados):
+    agora = datetime.now()
+    for regra in REGRAS_POR_EVENTO.get(evento, ()):
+        estado = obter_progresso_regra(regra)
+        if estado["desbloqueada"]: continue
+        filtro = regra.get("filtro")
+        if filtro and not filtro(dados):
+            if regra["tipo"] == "sequencia_dias": estado["inicio"], estado["valor"] = None, 0 # Sequência interrompida
+            continue
+        ATUALIZADORES_REGRAS[regra["tipo"]](regra, estado, dados, agora)
+        if estado["valor"] >= estado["meta"]:
+            if "passo" in regra: estado["meta"] = estado["valor"] + regra["passo"]
+            else: estado["desbloqueada"] = True
+            adicionar_conquista(regra["titulo"].format(valor=estado["valor"]))
+            if regra.get("pontos"): adicionar_pontos(regra["pontos"], regra.get("motivo", ""))
+
+# --- Catálogo de Desafios ---
+# Cada desafio tem tags que permitem associá-lo às maiores despesas do usuário
+CATALOGO_DESAFIOS = [
+    {
+        "titulo": "Semana Sem Delivery",
+        "descricao": "Evite pedir comida por delivery por uma semana inteira.",
+        "dificuldade": "Médio",
+        "pontos": 30,
+        "duracao_dias": 7,
+        "tags": ("delivery", "alimentacao", "despesas_variaveis")
+    },
+    {
+        "titulo": "Dia de Registro Total",
+        "descricao": "Registre absolutamente todos os seus gastos por um dia inteiro, até os centavos.",
+        "dificuldade": "Fácil",
+        "pontos": 15,
+        "duracao_dias": 1,
+        "tags": ("controle", "despesas_variaveis")
+    },
+    {
+        "titulo": "Economia de R$50",
+        "descricao": "Encontre formas de economizar R$50 esta semana em gastos que você normalmente faria.",
+        "dificuldade": "Médio",
+        "pontos": 25,
+        "duracao_dias": 7,
+        "tags": ("economia", "despesas_variaveis", "lazer", "compras")
+    },
+    {
+        "titulo": "Pesquisa de Preços Essenciais",
+        "descricao": "Compare preços de 3 itens essenciais da sua lista de compras em 3 lugares diferentes antes de comprar.",
+        "dificuldade": "Fácil",
+        "pontos": 20,
+        "duracao_dias": 3,
+        "tags": ("mercado", "alimentacao", "compras")
+    },
+    {
+        "titulo": "Dia Sem Gastos Supérfluos",
+        "descricao": "Passe um dia inteiro sem realizar nenhum gasto que não seja absolutamente essencial (alimentação básica, transporte obrigatório).",
+        "dificuldade": "Difícil",
+        "pontos": 40,
+        "duracao_dias": 1,
+        "tags": ("despesas_variaveis", "lazer", "compras", "delivery")
+    },
+    {
+        "titulo": "Revisão de Assinaturas",
+        "descricao": "Revise todas as suas assinaturas mensais (streaming, apps, etc.) e cancele pelo menos uma que não usa com frequência.",
+        "dificuldade": "Médio",
+        "pontos": 35,
+        "duracao_dias": 2,
+        "tags": ("assinaturas", "despesas_fixas")
+    },
+    {
+        "titulo": "Semana do Transporte Consciente",
+        "descricao": "Troque pelo menos 3 corridas de aplicativo por transporte público, carona ou caminhada nesta semana.",
+        "dificuldade": "Médio",
+        "pontos": 30,
+        "duracao_dias": 7,
+        "tags": ("transporte", "despesas_variaveis")
+    },
+    {
+        "titulo": "Caça aos Vilões da Conta de Luz",
+        "descricao": "Identifique e desligue da tomada os aparelhos em stand-by e reduza o tempo de banho quente por 5 dias.",
+        "dificuldade": "Fácil",
+        "pontos": 20,
+        "duracao_dias": 5,
+        "tags": ("contas_casa", "despesas_fixas")
+    },
+    {
+        "titulo": "Ligação de Negociação",
+        "descricao": "Entre em contato com o credor da sua dívida com juros mais altos e peça uma proposta de desconto ou redução de juros.",
+        "dificuldade": "Difícil",
+        "pontos": 45,
+        "duracao_dias": 3,
+        "tags": ("dividas",)
+    },
+    {
+        "titulo": "Primeiros R$100 da Reserva",
+        "descricao": "Separe R$100 em uma conta ou aplicação com liquidez diária exclusiva para emergências.",
+        "dificuldade": "Médio",
+        "pontos": 35,
+        "duracao_dias": 7,
+        "tags": ("reserva", "economia")
+    },
+]
+
+# Palavras (já normalizadas) que ligam a descrição de uma despesa a uma tag do catálogo
+PALAVRAS_CHAVE_TAGS = {
+    "delivery": "delivery", "ifood": "delivery", "rappi": "delivery", "lanche": "delivery", "lanches": "delivery",
+    "assinatura": "assinaturas", "assinaturas": "assinaturas", "streaming": "assinaturas", "netflix": "assinaturas",
+    "spotify": "assinaturas", "apps": "assinaturas",
+    "mercado": "mercado", "supermercado": "mercado", "feira": "mercado", "padaria": "mercado",
+    "restaurante": "alimentacao", "restaurantes": "alimentacao", "alimentacao": "alimentacao", "comida": "alimentacao",
+    "lazer": "lazer", "bar": "lazer", "bares": "lazer", "cinema": "lazer", "festa": "lazer", "festas": "lazer",
+    "uber": "transporte", "99": "transporte", "transporte": "transporte", "combustivel": "transporte",
+    "gasolina": "transporte", "onibus": "transporte", "estacionamento": "transporte",
+    "luz": "contas_casa", "energia": "contas_casa", "agua": "contas_casa", "gas": "contas_casa",
+    "internet": "contas_casa", "celular": "contas_casa",
+    "compras": "compras", "roupa": "compras", "roupas": "compras", "shopping": "compras",
+}
+
+def normalizar_texto(texto):
+    """Remove acentos, converte para minúsculas e compacta espaços."""
+    sem_acentos = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return " ".join(sem_acentos.lower().split())
+
+class CatalogoDesafios:
+    """
+    Catálogo de desafios carregado uma única vez e indexado por tag.
+    A busca por candidatos só visita os desafios das tags pedidas.
+    """
+    def __init__(self, definicoes):
+        self.definicoes = [DefinicaoDesafio(**definicao) for definicao in definicoes]
+        self.por_titulo = {definicao.titulo: definicao for definicao in self.definicoes}
+        self.por_tag = {}
+        for indice, definicao in enumerate(self.definicoes):
+            for tag in definicao.tags:
+                self.por_tag.setdefault(tag, []).append(indice)
+
+    def candidatos(self, pesos_tags, titulos_excluidos=()):
+        pontuacao = {}
+        for tag, peso in pesos_tags.items():
+            for indice in self.por_tag.get(tag, ()):
+                pontuacao[indice] = pontuacao.get(indice, 0) + peso
+        return [(self.definicoes[indice], peso) for indice, peso in pontuacao.items()
+                if self.definicoes[indice].titulo not in titulos_excluidos]
+
+@st.cache_resource
+def carregar_catalogo_desafios():
+    return CatalogoDesafios(CATALOGO_DESAFIOS)
+
+PESO_TAG_ORIGEM = 0.1 # Despesas sem palavra-chave (ex.: aluguel) só puxam de leve para "despesas_fixas"/"despesas_variaveis"
+
+def calcular_pesos_tags_perfil(limite_categorias=3):
+    # Pesos das tags a partir das maiores categorias de despesa reconhecidas por palavra-chave
+    dados = st.session_state.dados_financeiros
+    despesas = [(valor, categoria, "despesas_fixas") for categoria, valor in dados["despesas_fixas"].items()]
+    despesas += [(valor, categoria, "despesas_variaveis") for categoria, valor in dados["despesas_variaveis"].items()]
+    total = sum(valor for valor, _, _ in despesas)
+    pesos = {}; reconhecidas = []
+    for valor, categoria, origem in despesas:
+        peso = valor / total if total > 0 else 1
+        tags = {PALAVRAS_CHAVE_TAGS[palavra] for palavra in normalizar_texto(categoria).split() if palavra in PALAVRAS_CHAVE_TAGS}
+        if tags: reconhecidas.append((peso, categoria, tags))
+        else: pesos[origem] = pesos.get(origem, 0) + peso * PESO_TAG_ORIGEM
+    for peso, _, tags in heapq.nlargest(limite_categorias, reconhecidas, key=lambda r: r[0]):
+        for tag in tags: pesos[tag] = pesos.get(tag, 0) + peso
+    if dados["dividas"]: pesos["dividas"] = pesos.get("dividas", 0) + 0.5
+    if dados.get("renda_mensal") and not dados.get("reserva_emergencia"): pesos["reserva"] = pesos.get("reserva", 0) + 0.3
+    return pesos
+
 def gerar_desafio_aleatorio():
-    desafios = [
-        {
-            "titulo": "Semana Sem Delivery",
-            "descricao": "Evite pedir comida por delivery por uma semana inteira.",
-            "dificuldade": "Médio",
-            "pontos": 30,
-            "duracao_dias": 7
-        },
-        {
-            "titulo": "Dia de Registro Total",
-            "descricao": "Registre absolutamente todos os seus gastos por um dia inteiro, até os centavos.",
-            "dificuldade": "Fácil",
-            "pontos": 15,
-            "duracao_dias": 1
-        },
-        {
-            "titulo": "Economia de R$50",
-            "descricao": "Encontre formas de economizar R$50 esta semana em gastos que você normalmente faria.",
-            "dificuldade": "Médio",
-            "pontos": 25,
-            "duracao_dias": 7
-        },
-        {
-            "titulo": "Pesquisa de Preços Essenciais",
-            "descricao": "Compare preços de 3 itens essenciais da sua lista de compras em 3 lugares diferentes antes de comprar.",
-            "dificuldade": "Fácil",
-            "pontos": 20,
-            "duracao_dias": 3
-        },
-        {
-            "titulo": "Dia Sem Gastos Supérfluos",
-            "descricao": "Passe um dia inteiro sem realizar nenhum gasto que não seja absolutamente essencial (alimentação básica, transporte obrigatório).",
-            "dificuldade": "Difícil",
-            "pontos": 40,
-            "duracao_dias": 1
-        },
-        {
-            "titulo": "Revisão de Assinaturas",
-            "descricao": "Revise todas as suas assinaturas mensais (streaming, apps, etc.) e cancele pelo menos uma que não usa com frequência.",
-            "dificuldade": "Médio",
-            "pontos": 35,
-            "duracao_dias": 2
-        }
-    ]
-    
-    desafio = random.choice(desafios)
-    data_inicio = datetime.now()
-    data_fim = data_inicio + timedelta(days=desafio["duracao_dias"])
-    
-    desafio["data_inicio"] = data_inicio
-    desafio["data_fim"] = data_fim
-    desafio["concluido"] = False
-    
-    return desafio
+    catalogo = carregar_catalogo_desafios()
+    titulos_ativos = {d.titulo for d in st.session_state.desafios_ativos}
+    candidatos = catalogo.candidatos(calcular_pesos_tags_perfil(), titulos_ativos)
+    if candidatos:
+        definicoes, pesos = zip(*candidatos)
+        definicao = random.choices(definicoes, weights=pesos)[0]
+    else: # Sem perfil (ou todos já ativos): sorteia em todo o catálogo
+        livres = [d for d in catalogo.definicoes if d.titulo not in titulos_ativos]
+        definicao = random.choice(livres or catalogo.definicoes)
+    return Desafio(definicao) # Só as datas são da sessão; a definição é compartilhada
+
+# --- Agenda de Expiração dos Desafios ---
+# Heap de (data_fim, titulo) ordenado pelo prazo; entradas de desafios já
+# concluídos ou abandonados são descartadas quando chegam ao topo.
+def agendar_expiracao_desafio(desafio):
+    heapq.heappush(st.session_state.agenda_desafios, (desafio.data_fim, desafio.titulo))
+
+def processar_desafios_expirados(agora=None):
+    agenda = st.session_state.agenda_desafios
+    agora = agora or datetime.now()
+    if not agenda or agenda[0][0] > agora: return []
+    ativos = {d.titulo: d for d in st.session_state.desafios_ativos}
+    expirados = []
+    while agenda and agenda[0][0] <= agora:
+        data_fim, titulo = heapq.heappop(agenda)
+        desafio = ativos.get(titulo)
+        if desafio is not None and desafio.data_fim == data_fim:
+            expirados.append(desafio)
+    if expirados:
+        ids_expirados = {id(d) for d in expirados}
+        st.session_state.desafios_ativos = [d for d in st.session_state.desafios_ativos if id(d) not in ids_expirados]
+    return expirados
 
 def aceitar_desafio(desafio):
-    titulos_ativos = [d["titulo"] for d in st.session_state.desafios_ativos]
-    if desafio["titulo"] not in titulos_ativos:
+    titulos_ativos = [d.titulo for d in st.session_state.desafios_ativos]
+    if desafio.titulo not in titulos_ativos:
         st.session_state.desafios_ativos.append(desafio)
-        st.success(f"🎯 Desafio aceito: {desafio['titulo']}")
+        agendar_expiracao_desafio(desafio)
+        st.success(f"🎯 Desafio aceito: {desafio.titulo}")
         adicionar_pontos(5, "Aceitou um novo desafio")
 
+LIMITE_HISTORICO_DESAFIOS = 100 # Desafios concluídos mantidos em detalhe na sessão
+
 def concluir_desafio(indice):
     if 0 <= indice < len(st.session_state.desafios_ativos):
         desafio = st.session_state.desafios_ativos[indice]
-        desafio["concluido"] = True
+        desafio.concluir()
         
         st.session_state.desafios_concluidos.append(desafio)
+        st.session_state.total_desafios_concluidos += 1
+        # Só os mais recentes ficam guardados em detalhe; o total fica no contador
+        del st.session_state.desafios_concluidos[:-LIMITE_HISTORICO_DESAFIOS]
         st.session_state.desafios_ativos.pop(indice)
         
-        adicionar_pontos(desafio["pontos"], f"Concluiu o desafio: {desafio['titulo']}")
-        
-        if len(st.session_state.desafios_concluidos) == 1:
-            adicionar_conquista("Primeiro Desafio Concluído! 🌟")
-        elif len(st.session_state.desafios_concluidos) == 5:
-            adicionar_conquista("Desafiador Experiente: 5 Desafios Concluídos! 🔥")
-        elif len(st.session_state.desafios_concluidos) == 10:
-            adicionar_conquista("Mestre dos Desafios: 10 Desafios Concluídos! 🏅")
+        adicionar_pontos(desafio.pontos, f"Concluiu o desafio: {desafio.titulo}")
+        registrar_evento("desafio_concluido", dificuldade=desafio.dificuldade)
 
 # --- Funções de Diagnóstico Financeiro (sem alterações) ---
 def calcular_saude_financeira():
@@ -337,11 +1068,11 @@ def calcular_saude_financeira():
     if not dados["renda_mensal"]: return resultado
     total_despesas_fixas = sum(dados["despesas_fixas"].values()) if dados["despesas_fixas"] else 0
     total_despesas_variaveis = sum(dados["despesas_variaveis"].values()) if dados["despesas_variaveis"] else 0
-    total_parcelas_dividas = sum(d.get("parcela_mensal", 0) for d in dados["dividas"].values() if d.get("parcela_mensal"))
+    total_parcelas_dividas = sum(d.parcela_mensal for d in dados["dividas"].values())
     total_despesas = total_despesas_fixas + total_despesas_variaveis + total_parcelas_dividas
     if dados["renda_mensal"] > 0:
         resultado["comprometimento_renda"] = (total_despesas / dados["renda_mensal"]) * 100
-    total_dividas = sum(d.get("valor_total", 0) for d in dados["dividas"].values())
+    total_dividas = sum(d.valor_total for d in dados["dividas"].values())
     if dados["renda_mensal"] > 0:
         resultado["endividamento"] = (total_dividas / (dados["renda_mensal"] * 12)) * 100 if dados["renda_mensal"] * 12 > 0 else float('inf')
     reserva = dados.get("reserva_emergencia", 0)
@@ -366,16 +1097,20 @@ def calcular_saude_financeira():
     return resultado
 
 def gerar_grafico_despesas():
+    # Retorna a imagem PNG do gráfico; a mesma imagem é reaproveitada pelo dashboard e pelos relatórios
     dados = st.session_state.dados_financeiros
     todas_despesas = {}
     for categoria, valor in dados["despesas_fixas"].items(): todas_despesas[f"Fixo: {categoria}"] = valor
     for categoria, valor in dados["despesas_variaveis"].items(): todas_despesas[f"Variável: {categoria}"] = valor
-    for nome_divida, info_divida in dados["dividas"].items():
-        if "parcela_mensal" in info_divida and info_divida["parcela_mensal"]:
-            todas_despesas[f"Dívida: {nome_divida}"] = info_divida["parcela_mensal"]
+    for nome_divida, divida in dados["dividas"].items():
+        if divida.parcela_mensal: todas_despesas[f"Dívida: {nome_divida}"] = divida.parcela_mensal
     if not todas_despesas: return None
-    fig, ax = plt.subplots(figsize=(10, 6))
-    despesas_ordenadas = dict(sorted(todas_despesas.items(), key=lambda x: x[1], reverse=True))
+    return desenhar_grafico_despesas(tuple(sorted(todas_despesas.items(), key=lambda x: x[1], reverse=True)))
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def desenhar_grafico_despesas(despesas_ordenadas):
+    fig = Figure(figsize=(10, 6)); ax = fig.subplots()
+    despesas_ordenadas = dict(despesas_ordenadas)
     cores = plt.cm.viridis(np.linspace(0, 1, len(despesas_ordenadas))) # Paleta de cores diferente
     wedges, texts, autotexts = ax.pie(
         despesas_ordenadas.values(), labels=None, autopct='%1.1f%%',
@@ -384,8 +1119,10 @@ def gerar_grafico_despesas():
         autotext.set_color('black'); autotext.set_fontsize(9); autotext.set_fontweight('bold')
     ax.legend(wedges, despesas_ordenadas.keys(), title="Categorias", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1), fontsize='small')
     ax.set_title("Distribuição de Despesas Mensais", fontsize=16, pad=20, color="#5c1691")
-    plt.tight_layout()
-    return fig
+    fig.tight_layout()
+    imagem = BytesIO()
+    fig.savefig(imagem, format="png")
+    return imagem.getvalue()
 
 def calcular_tempo_quitacao_dividas():
     dados = st.session_state.dados_financeiros
@@ -393,29 +1130,32 @@ def calcular_tempo_quitacao_dividas():
     if not dados["dividas"]: return resultado
     tempo_maximo = 0
     for nome, divida in dados["dividas"].items():
-        if "valor_total" in divida and "parcela_mensal" in divida and divida["parcela_mensal"] > 0:
-            valor_total = divida["valor_total"]; parcela_mensal = divida["parcela_mensal"]
-            taxa_juros_mensal = divida.get("taxa_juros_mensal", 0) / 100 if "taxa_juros_mensal" in divida else 0
-            saldo_devedor = valor_total; meses = 0; total_pago = 0; total_juros = 0
-            while saldo_devedor > 0.01 and meses < 600: # Limite e condição de parada
-                meses += 1; juros_mes = saldo_devedor * taxa_juros_mensal; total_juros += juros_mes
-                amortizacao = parcela_mensal - juros_mes
-                if amortizacao <= 0: meses = float('inf'); break # Parcela não cobre juros
-                pagamento_efetivo = min(parcela_mensal, saldo_devedor + juros_mes)
-                total_pago += pagamento_efetivo
-                saldo_devedor += juros_mes - pagamento_efetivo
-            resultado["dividas"][nome] = {"tempo_meses": meses, "total_pago": total_pago, "total_juros": total_juros}
-            resultado["valor_total"] += valor_total; resultado["juros_total"] += total_juros
-            if meses != float('inf'): tempo_maximo = max(tempo_maximo, meses)
-            else: tempo_maximo = float('inf') # Se uma dívida é infinita, o total é infinito
+        quitacao = divida.simular_quitacao()
+        if quitacao is None: continue # Sem parcela não há como estimar
+        resultado["dividas"][nome] = quitacao
+        resultado["valor_total"] += divida.valor_total; resultado["juros_total"] += quitacao["total_juros"]
+        tempo_maximo = max(tempo_maximo, quitacao["tempo_meses"]) # Se uma dívida é infinita, o total é infinito
     resultado["tempo_total_meses"] = tempo_maximo
     return resultado
 
+def montar_tabela_dividas(info_dividas):
+    # Linhas da tabela de quitação, usadas no dashboard e nos relatórios
+    dados_tabela_div = []
+    for nome, info in info_dividas["dividas"].items():
+        div_orig = st.session_state.dados_financeiros["dividas"][nome]
+        tempo_str = f"{int(info['tempo_meses'] // 12)}a {int(info['tempo_meses'] % 12)}m" if info['tempo_meses'] != float('inf') and info['tempo_meses'] > 0 else ("Nunca" if info['tempo_meses'] == float('inf') else "N/A")
+        dados_tabela_div.append({
+            "Dívida": nome, "Valor Total": f"R$ {div_orig.valor_total:.2f}", 
+            "Parcela": f"R$ {div_orig.parcela_mensal:.2f}", "Juros (% a.m.)": f"{div_orig.taxa_juros_mensal:.2f}",
+            "Tempo p/ Quitar": tempo_str, "Total de Juros Pago": f"R$ {info.get('total_juros',0):.2f}"
+        })
+    return dados_tabela_div
+
 def sugerir_metodo_quitacao():
     dados = st.session_state.dados_financeiros
     if not dados["dividas"]: return {"metodo": "Nenhum", "explicacao": "Não há dívidas cadastradas."}
-    total_dividas_valor = sum(d.get("valor_total", 0) for d in dados["dividas"].values())
-    dividas_com_juros_altos = sum(1 for d in dados["dividas"].values() if d.get("taxa_juros_mensal", 0) > 3) # Juros > 3% a.m.
+    total_dividas_valor = sum(d.valor_total for d in dados["dividas"].values())
+    dividas_com_juros_altos = sum(1 for d in dados["dividas"].values() if d.taxa_juros_mensal > 3) # Juros > 3% a.m.
     quantidade_dividas = len(dados["dividas"])
     perfil_motivacional = "conquistas_rapidas"
     if dividas_com_juros_altos > 0 and (dividas_com_juros_altos >= quantidade_dividas / 2 or total_dividas_valor > 5000):
@@ -429,20 +1169,761 @@ def sugerir_metodo_quitacao():
         explicacao = "Analise suas dívidas. Se tiver uma pequena fácil de quitar, comece por ela para ganhar ânimo (Bola de Neve). Depois, ataque as com juros mais altos (Avalanche)."
     return {"metodo": metodo, "explicacao": explicacao}
 
+# --- Otimizador da Sobra Mensal ---
+PESO_PRIORIDADE_META = {"Alta": 0, "Média": 1, "Baixa": 2}
+HORIZONTE_MAXIMO_MESES = 600
+
+def calcular_sobra_mensal(dados):
+    # Renda menos despesas e parcelas mínimas das dívidas
+    if not dados.get("renda_mensal"): return 0.0
+    total_despesas = sum(dados["despesas_fixas"].values()) + sum(dados["despesas_variaveis"].values())
+    total_parcelas = sum(d.parcela_mensal for d in dados["dividas"].values())
+    return dados["renda_mensal"] - total_despesas - total_parcelas
+
+def distribuir_em_ordem(valor, demandas):
+    # Atende as demandas na ordem dada (último eixo) até o valor acabar; a última pode ser parcial
+    demandas = np.maximum(demandas, 0)
+    return np.clip(valor - (np.cumsum(demandas, axis=-1) - demandas), 0, demandas)
+
+def otimizar_alocacao_sobra(dados=None, sobra_extra=0.0, reaproveitar_parcelas=True, hoje=None):
+    # Reduz o perfil a tuplas para que a simulação seja calculada uma vez por perfil (st.cache_data)
+    dados = st.session_state.dados_financeiros if dados is None else dados
+    hoje = hoje or datetime.now()
+    dividas = tuple((nome, d.valor_total, d.taxa_juros_mensal, d.parcela_mensal) for nome, d in dados["dividas"].items() if d.valor_total > 0)
+    metas = tuple((nome, m.valor, m.meses_restantes(hoje), m.prioridade) for nome, m in dados["metas"].items())
+    return simular_alocacao_sobra(calcular_sobra_mensal(dados) + sobra_extra, dividas, metas, reaproveitar_parcelas)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def simular_alocacao_sobra(sobra, dividas, metas, reaproveitar_parcelas):
+    """
+    dividas: tupla de (nome, saldo, taxa mensal em %, parcela); metas: tupla de (nome, valor, meses restantes, prioridade).
+    Distribui a sobra mensal entre metas e dívidas, mês a mês, em três etapas:
+    1. Cada meta ainda viável recebe o aporte que falta dividido pelos meses até o prazo, por prioridade
+       e, dentro dela, das mais baratas às mais caras, o que cumpre o maior número de prazos com a sobra disponível.
+       Viável é a meta com prazo ainda por vencer cujo aporte cabe inteiro no que sobrou; as outras
+       não cumpririam o prazo de qualquer jeito e não podem travar as dívidas.
+    2. O restante amortiza as dívidas de maior juros primeiro (avalanche), o que minimiza os juros pagos.
+    3. Sem dívidas a pagar, o que sobra antecipa as metas por prioridade, inclusive as atrasadas.
+    Parcelas de dívidas quitadas voltam para a sobra. Cada mês é resolvido com operações do numpy
+    sobre todas as dívidas e metas de uma vez.
+    """
+    saldo = np.array([d[1] for d in dividas], dtype=float)
+    taxa = np.array([d[2] / 100 for d in dividas], dtype=float)
+    parcela = np.array([d[3] for d in dividas], dtype=float)
+    ordem_avalanche = np.argsort(-taxa, kind="stable")
+    valor_meta = np.array([m[1] for m in metas], dtype=float)
+    prazo_meta = np.array([m[2] for m in metas], dtype=int)
+    peso_meta = np.array([PESO_PRIORIDADE_META.get(m[3], 1) for m in metas], dtype=int)
+    ordem_prioridade = np.argsort(peso_meta, kind="stable")
+    acumulado = np.zeros(len(metas))
+    mes_quitada = np.zeros(len(dividas), dtype=int)
+    mes_atingida = np.zeros(len(metas), dtype=int)
+
+    alocacoes = []; juros_total = 0.0
+    for mes in range(1, HORIZONTE_MAXIMO_MESES + 1):
+        ativas = saldo > 0.01
+        faltante = valor_meta - acumulado
+        if not ativas.any() and not (faltante > 0.01).any(): break
+        # Juros do mês e parcelas mínimas (já descontadas da sobra)
+        juros = saldo * taxa * ativas
+        juros_total += juros.sum()
+        saldo += juros
+        pagamento = np.minimum(parcela, saldo) * ativas
+        saldo -= pagamento
+        livre = max(sobra, 0) + (parcela[~ativas].sum() if reaproveitar_parcelas else 0)
+        # 1. Aporte necessário para cada meta que ainda pode cumprir o prazo
+        no_prazo = (faltante > 0.01) & (prazo_meta >= mes)
+        necessario = np.where(no_prazo, faltante / np.maximum(prazo_meta - (mes - 1), 1), 0)
+        aporte = np.zeros(len(metas))
+        for i in np.lexsort((necessario, peso_meta)):
+            if no_prazo[i] and necessario[i] <= livre + 0.01: aporte[i] = min(necessario[i], livre); livre -= aporte[i]
+        # 2. Avalanche: extra para as dívidas de maior juros
+        extra = np.zeros(len(dividas))
+        extra[ordem_avalanche] = distribuir_em_ordem(livre, saldo[ordem_avalanche])
+        saldo -= extra; livre -= extra.sum()
+        # 3. Antecipa metas com o que sobrou
+        adiantamento = np.zeros(len(metas))
+        adiantamento[ordem_prioridade] = distribuir_em_ordem(livre, (faltante - aporte)[ordem_prioridade])
+        aporte += adiantamento; livre -= adiantamento.sum()
+        acumulado += aporte
+
+        mes_quitada[(mes_quitada == 0) & (saldo <= 0.01)] = mes
+        mes_atingida[(mes_atingida == 0) & (acumulado >= valor_meta - 0.01)] = mes
+        alocacoes.append(np.concatenate([pagamento + extra, aporte, [livre]]))
+
+    colunas = [f"Dívida: {d[0]}" for d in dividas] + [f"Meta: {m[0]}" for m in metas] + ["Livre"]
+    return {
+        "sobra_mensal": sobra,
+        "colunas": colunas,
+        "alocacoes": np.array(alocacoes).reshape(len(alocacoes), len(colunas)),
+        "juros_total": juros_total,
+        "mes_quitacao": int(mes_quitada.max()) if len(dividas) and (mes_quitada > 0).all() else (0 if not len(dividas) else None),
+        "metas": {nome: {"mes_atingida": int(mes_atingida[i]) or None, "prazo_meses": int(prazo_meta[i]),
+                         "no_prazo": bool(0 < mes_atingida[i] <= prazo_meta[i])} for i, (nome, *_) in enumerate(metas)},
+    }
+
+def exibir_plano_sobra():
+    dados = st.session_state.dados_financeiros
+    if not dados["dividas"] and not dados["metas"]:
+        st.info("Cadastre dívidas ou metas no diagnóstico para ver como dividir sua sobra mensal.")
+        return
+    plano = otimizar_alocacao_sobra(dados)
+    if plano["sobra_mensal"] <= 0:
+        st.warning(f"⚠️ Suas despesas e parcelas superam a renda em R$ {-plano['sobra_mensal']:.2f}. Sem sobra, o plano só considera as parcelas atuais.")
+    # Só as parcelas atuais: as metas não recebem nada sem sobra e não mudam os juros, então ficam de fora
+    sem_plano = otimizar_alocacao_sobra({**dados, "metas": {}}, sobra_extra=-max(plano["sobra_mensal"], 0), reaproveitar_parcelas=False)
+    col1, col2, col3 = st.columns(3)
+    with col1: st.metric("Sobra Mensal", f"R$ {plano['sobra_mensal']:.2f}")
+    with col2:
+        # Sem o plano, uma parcela menor que os juros faz a dívida crescer para sempre
+        economia = f"R$ {plano['juros_total'] - sem_plano['juros_total']:.2f}" if sem_plano["mes_quitacao"] is not None else "Sem o plano: nunca quita"
+        st.metric("Juros Totais com o Plano", f"R$ {plano['juros_total']:.2f}", delta=economia, delta_color="inverse",
+                  help="Comparado a pagar apenas as parcelas atuais.")
+    with col3:
+        metas_no_prazo = sum(1 for m in plano["metas"].values() if m["no_prazo"])
+        st.metric("Metas no Prazo", f"{metas_no_prazo}/{len(plano['metas'])}")
+    if plano["mes_quitacao"] is None: st.error("⚠️ Mesmo com o plano, alguma dívida não é quitada em 50 anos. Renegocie as condições!")
+    elif plano["mes_quitacao"] > 0: st.info(f"⏱️ Com o plano, todas as dívidas são quitadas em {plano['mes_quitacao'] // 12} anos e {plano['mes_quitacao'] % 12} meses.")
+    for nome, meta in plano["metas"].items():
+        if not meta["no_prazo"]:
+            quando = f"no mês {meta['mes_atingida']}" if meta["mes_atingida"] else "dentro do horizonte do plano"
+            st.caption(f"🎯 A meta '{nome}' ({meta['prazo_meses']} meses restantes) só é alcançada {quando}.")
+    if len(plano["alocacoes"]):
+        primeiros_meses = plano["alocacoes"][:12]
+        tabela = pd.DataFrame(primeiros_meses.round(2), columns=plano["colunas"])
+        tabela.insert(0, "Mês", range(1, len(tabela) + 1))
+        st.dataframe(tabela, hide_index=True, use_container_width=True)
+        st.caption("Metas recebem primeiro o necessário para cumprir o prazo (por prioridade); o restante vai para a dívida com maiores juros.")
+
+# --- Simulador "E se...?" ---
+# A grade de quitação é calculada uma vez por perfil de dívidas (st.cache_data) para todas as
+# combinações de pagamento extra e corte de despesas; mover os sliders vira uma consulta à grade.
+PASSO_EXTRA_SIMULADOR = 50.0
+PASSO_CORTE_SIMULADOR = 5
+CORTE_MAXIMO_SIMULADOR = 50 # % das despesas variáveis
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def calcular_grade_quitacao(dividas, extras, cortes_valor):
+    """
+    dividas: tupla de (saldo, taxa mensal em %, parcela). Para cada par (extra, corte), o valor extra
+    mensal vai para a dívida de maior juros (avalanche). Todas as combinações são simuladas juntas,
+    uma linha da matriz de saldos por combinação. Retorna (meses para quitar tudo, juros totais), ambos
+    com forma (len(extras), len(cortes_valor)); meses é infinito quando a quitação não acontece.
+    """
+    saldo_inicial = np.array([d[0] for d in dividas], dtype=float)
+    taxa = np.array([d[1] / 100 for d in dividas], dtype=float)
+    parcela = np.array([d[2] for d in dividas], dtype=float)
+    ordem = np.argsort(-taxa, kind="stable")
+    saldo_inicial, taxa, parcela = saldo_inicial[ordem], taxa[ordem], parcela[ordem]
+
+    aporte = (np.asarray(extras, dtype=float)[:, None] + np.asarray(cortes_valor, dtype=float)[None, :]).reshape(-1, 1)
+    saldo = np.tile(saldo_inicial, (len(aporte), 1))
+    meses = np.full(len(aporte), np.inf); juros_total = np.zeros(len(aporte))
+    for mes in range(1, HORIZONTE_MAXIMO_MESES + 1):
+        ativas = saldo > 0.01
+        pendentes = ativas.any(axis=1)
+        if not pendentes.any(): break
+        juros = saldo * taxa * ativas
+        juros_total += juros.sum(axis=1)
+        saldo += juros
+        saldo -= np.minimum(parcela, saldo) * ativas
+        saldo -= distribuir_em_ordem(aporte, saldo)
+        meses[pendentes & ~(saldo > 0.01).any(axis=1)] = mes
+    formato = (len(extras), len(cortes_valor))
+    return meses.reshape(formato), juros_total.reshape(formato)
+
+def formatar_meses(meses):
+    if meses == np.inf: return "Nunca"
+    return f"{int(meses) // 12}a {int(meses) % 12}m"
+
+@st.fragment
+def exibir_simulador_e_se():
+    # Mover um slider reexecuta só este painel, sem passar por main(): marca a sessão e a reidrata aqui
+    with sessao_em_uso():
+        reidratar_sessao()
+        _exibir_simulador_e_se()
+
+def _exibir_simulador_e_se():
+    dados = st.session_state.dados_financeiros
+    dividas = tuple((d.valor_total, d.taxa_juros_mensal, d.parcela_mensal) for d in dados["dividas"].values() if d.valor_total > 0)
+    if not dividas: return
+    total_variaveis = sum(dados["despesas_variaveis"].values())
+    extra_maximo = max(500.0, np.ceil(dados["renda_mensal"] * 0.25 / PASSO_EXTRA_SIMULADOR) * PASSO_EXTRA_SIMULADOR)
+    extras = tuple(np.arange(0, extra_maximo + PASSO_EXTRA_SIMULADOR, PASSO_EXTRA_SIMULADOR))
+    cortes_pct = tuple(range(0, CORTE_MAXIMO_SIMULADOR + PASSO_CORTE_SIMULADOR, PASSO_CORTE_SIMULADOR))
+    meses, juros = calcular_grade_quitacao(dividas, extras, tuple(p / 100 * total_variaveis for p in cortes_pct))
+
+    col_extra, col_corte = st.columns(2)
+    with col_extra:
+        extra = st.slider("Pagamento extra por mês (R$)", 0.0, float(extras[-1]), 0.0, PASSO_EXTRA_SIMULADOR, key="slider_extra_e_se")
+    with col_corte:
+        corte = st.slider("Corte nas despesas variáveis (%)", 0, CORTE_MAXIMO_SIMULADOR, 0, PASSO_CORTE_SIMULADOR, key="slider_corte_e_se",
+                          help="O valor economizado também vai para as dívidas.", disabled=not total_variaveis)
+    i, j = int(round(extra / PASSO_EXTRA_SIMULADOR)), corte // PASSO_CORTE_SIMULADOR # Sliders andam no passo da grade
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        delta_meses = None if np.isinf(meses[i, j]) or np.isinf(meses[0, 0]) else f"{int(meses[i, j] - meses[0, 0])} meses"
+        st.metric("Tempo para Quitar Tudo", formatar_meses(meses[i, j]), delta=delta_meses, delta_color="inverse")
+    with col2:
+        delta_juros = None if np.isinf(meses[i, j]) or np.isinf(meses[0, 0]) else f"R$ {juros[i, j] - juros[0, 0]:.2f}"
+        st.metric("Juros Totais", f"R$ {juros[i, j]:.2f}" if not np.isinf(meses[i, j]) else "—", delta=delta_juros, delta_color="inverse")
+    with col3:
+        saude = calcular_saude_financeira()
+        comprometimento = saude["comprometimento_renda"] - (corte / 100 * total_variaveis) / dados["renda_mensal"] * 100
+        st.metric("Comprometimento de Renda", f"{comprometimento:.1f}%", delta=f"{comprometimento - saude['comprometimento_renda']:.1f} p.p.", delta_color="inverse")
+    curva = pd.DataFrame({"Extra (R$)": extras, "Meses para quitar": np.where(np.isinf(meses[:, j]), np.nan, meses[:, j])})
+    # Especificação Vega-Lite montada à mão: st.line_chart passa pelo Altair, que custa ~100 ms a cada movimento do slider
+    st.vega_lite_chart(curva, {"layer": [
+        {"mark": {"type": "line", "point": True}, "encoding": {"x": {"field": "Extra (R$)", "type": "quantitative"},
+                                                               "y": {"field": "Meses para quitar", "type": "quantitative"}}},
+        {"mark": {"type": "rule", "color": "#8629ff"}, "encoding": {"x": {"datum": extra}}}, # Extra escolhido no slider
+    ]}, use_container_width=True)
+
+# --- Histórico da Saúde Financeira ---
+# Um arquivo binário por sessão, só de acréscimo, com registros de tamanho fixo. Ainda não há login:
+# o arquivo é identificado por um código aleatório da sessão, nunca pelo nome digitado, que qualquer um pode repetir.
+# Por isso o gráfico cobre a sessão atual, e o arquivo é apagado junto com as sessões expiradas em disco.
+# A leitura usa mapeamento em memória (np.memmap): só as páginas do período pedido são lidas.
+REGISTRO_SAUDE = np.dtype([
+    ("instante", "<f8"), ("score", "<f4"), ("comprometimento_renda", "<f4"),
+    ("endividamento", "<f4"), ("reserva_emergencia", "<f4"),
+])
+INTERVALO_MINIMO_SNAPSHOT_SEGUNDOS = 3600 # Visitas ao dashboard gravam no máximo um registro por hora se nada mudar
+PONTOS_MAXIMOS_GRAFICO = 200
+
+class HistoricoSaude:
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def anexar(self, instante, saude):
+        registro = np.array([(instante, saude["score"], saude["comprometimento_renda"],
+                              saude["endividamento"], saude["reserva_emergencia"])], dtype=REGISTRO_SAUDE)
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with open(self.caminho, "ab") as arquivo: # Modo "a": cada registro é escrito inteiro no fim do arquivo
+            arquivo.write(registro.tobytes())
+
+    def ler(self):
+        try: total = os.path.getsize(self.caminho) // REGISTRO_SAUDE.itemsize
+        except OSError: total = 0
+        if total == 0: return np.zeros(0, dtype=REGISTRO_SAUDE)
+        # Ignora um eventual registro incompleto no fim (escrita interrompida)
+        return np.memmap(self.caminho, dtype=REGISTRO_SAUDE, mode="r", shape=(total,))
+
+def obter_historico_saude():
+    if not st.session_state.nome_usuario: return None
+    return HistoricoSaude(os.path.join(DIRETORIO_DADOS, "historico_saude", f"{st.session_state.id_historico_saude}.bin"))
+
+def registrar_snapshot_saude(saude, forcar=False):
+    historico = obter_historico_saude()
+    if historico is None or saude["classificacao"] == "Não disponível": return
+    agora = time.time()
+    registros = historico.ler()
+    if not forcar and len(registros):
+        ultimo = registros[-1]
+        mudou = any(abs(float(ultimo[campo]) - float(np.float32(saude[campo]))) > 1e-3 for campo in REGISTRO_SAUDE.names[1:])
+        if not mudou and agora - ultimo["instante"] < INTERVALO_MINIMO_SNAPSHOT_SEGUNDOS: return
+    historico.anexar(agora, saude)
+
+def reduzir_serie(registros, pontos_maximos=PONTOS_MAXIMOS_GRAFICO):
+    # Agrupa registros consecutivos em até pontos_maximos blocos e tira a média de cada um
+    if len(registros) <= pontos_maximos:
+        return {campo: np.asarray(registros[campo], dtype=float) for campo in REGISTRO_SAUDE.names}
+    limites = np.linspace(0, len(registros), pontos_maximos + 1).astype(int)[:-1]
+    tamanhos = np.diff(np.append(limites, len(registros)))
+    return {campo: np.add.reduceat(np.asarray(registros[campo], dtype=float), limites) / tamanhos for campo in REGISTRO_SAUDE.names}
+
+def exibir_evolucao_saude():
+    historico = obter_historico_saude()
+    if historico is None: return
+    registros = historico.ler()
+    if len(registros) < 2:
+        st.caption("Atualize seu diagnóstico enquanto usa o app para acompanhar sua evolução aqui.")
+        return
+    serie = reduzir_serie(registros)
+    tabela = pd.DataFrame({
+        "Score": serie["score"],
+        "Comprometimento de Renda (%)": serie["comprometimento_renda"],
+        "Endividamento (%)": serie["endividamento"],
+    }, index=pd.to_datetime(serie["instante"], unit="s"))
+    col_score, col_indices = st.columns(2)
+    with col_score: st.line_chart(tabela[["Score"]])
+    with col_indices: st.line_chart(tabela[["Comprometimento de Renda (%)", "Endividamento (%)"]])
+
+# --- Comparação com Outros Usuários ---
+# Distribuição anônima (só os números, sem nome) de score, comprometimento e endividamento de quem
+# concluiu o diagnóstico, guardada em esboços de quantis KLL: memória limitada, inserção O(1)
+# amortizada e esboços que podem ser somados. Cada processo do servidor grava só as próprias
+# contribuições em um arquivo; a consulta soma os arquivos dos outros processos ao esboço local.
+METRICAS_COORTE = {"score": True, "comprometimento_renda": False, "endividamento": False} # métrica -> maior é melhor?
+MINIMO_AMOSTRAS_COORTE = 20
+INTERVALO_SINCRONIZACAO_COORTE_SEGUNDOS = 300
+
+class EsbocoQuantis:
+    """
+    Esboço KLL: o nível h guarda itens que valem 2**h observações cada. Quando um nível enche, ele é
+    ordenado e metade dos itens (alternados, a partir de uma posição sorteada) sobe para o nível seguinte.
+    """
+    def __init__(self, k=200, niveis=None):
+        self.k = k
+        self.niveis = niveis or [[]]
+        self.ordenado = None # (valores, pesos acumulados), montado na primeira consulta
+
+    def capacidade(self, nivel):
+        # Níveis mais altos guardam mais itens; os de baixo encolhem em progressão geométrica (2/3)
+        return int(np.ceil(self.k * (2 / 3) ** (len(self.niveis) - nivel - 1))) + 1
+
+    def adicionar(self, valor):
+        self.niveis[0].append(float(valor)); self.ordenado = None
+        if len(self.niveis[0]) >= self.capacidade(0): self.compactar()
+
+    def compactar(self):
+        for nivel in range(len(self.niveis)):
+            itens = self.niveis[nivel]
+            if len(itens) < self.capacidade(nivel): continue
+            if nivel + 1 == len(self.niveis): self.niveis.append([])
+            itens.sort()
+            restante = [itens.pop()] if len(itens) % 2 else [] # Um item ímpar fica onde está
+            self.niveis[nivel + 1].extend(itens[random.random() < 0.5::2])
+            self.niveis[nivel] = restante
+
+    def combinar(self, outro):
+        while len(self.niveis) < len(outro.niveis): self.niveis.append([])
+        for nivel, itens in enumerate(outro.niveis): self.niveis[nivel].extend(itens)
+        self.compactar(); self.ordenado = None
+        return self
+
+    @property
+    def total(self):
+        return sum(len(itens) << nivel for nivel, itens in enumerate(self.niveis))
+
+    def fracao_abaixo(self, valor, inclusive=False):
+        # Fração (ponderada) das observações menores que o valor, em O(log n) após a primeira consulta
+        if self.ordenado is None:
+            valores = np.array([v for itens in self.niveis for v in itens])
+            pesos = np.array([1 << nivel for nivel, itens in enumerate(self.niveis) for _ in itens], dtype=float)
+            ordem = np.argsort(valores, kind="stable")
+            self.ordenado = (valores[ordem], np.concatenate([[0.0], np.cumsum(pesos[ordem])]))
+        valores, acumulado = self.ordenado
+        if not len(valores): return 0.0
+        return acumulado[np.searchsorted(valores, valor, side="right" if inclusive else "left")] / acumulado[-1]
+
+    def serializar(self):
+        return {"k": self.k, "niveis": self.niveis}
+
+    @classmethod
+    def desserializar(cls, dados):
+        return cls(dados["k"], [list(itens) for itens in dados["niveis"]])
+
+class CoorteSaude:
+    """Esboços locais deste processo mais os dos outros processos, relidos do disco de tempos em tempos."""
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+        self.caminho = os.path.join(diretorio, f"{uuid.uuid4().hex}.json")
+        self.locais = {metrica: EsbocoQuantis() for metrica in METRICAS_COORTE}
+        self.externos = {metrica: EsbocoQuantis() for metrica in METRICAS_COORTE}
+        self.combinados = None
+        self.sincronizado_em = 0.0
+        self.trava = threading.Lock()
+
+    def registrar(self, saude):
+        with self.trava:
+            for metrica in METRICAS_COORTE:
+                if np.isfinite(saude[metrica]): self.locais[metrica].adicionar(saude[metrica])
+            self.combinados = None
+            conteudo = {metrica: esboco.serializar() for metrica, esboco in self.locais.items()}
+        try:
+            with open(self.caminho + ".parcial", "w", encoding="utf-8") as arquivo: json.dump(conteudo, arquivo)
+            os.replace(self.caminho + ".parcial", self.caminho)
+        except OSError: pass # Sem disco, a comparação segue só com este processo
+
+    def sincronizar(self):
+        externos = {metrica: EsbocoQuantis() for metrica in METRICAS_COORTE}
+        for nome_arquivo in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome_arquivo)
+            if not nome_arquivo.endswith(".json") or caminho == self.caminho: continue
+            try:
+                with open(caminho, encoding="utf-8") as arquivo: conteudo = json.load(arquivo)
+            except (OSError, ValueError): continue
+            for metrica, esboco in externos.items():
+                if metrica in conteudo: esboco.combinar(EsbocoQuantis.desserializar(conteudo[metrica]))
+        with self.trava:
+            self.externos = externos; self.combinados = None; self.sincronizado_em = time.time()
+
+    def percentil(self, metrica, valor):
+        # Percentual de usuários em situação pior; None enquanto houver poucas amostras
+        if time.time() - self.sincronizado_em > INTERVALO_SINCRONIZACAO_COORTE_SEGUNDOS: self.sincronizar()
+        with self.trava:
+            if self.combinados is None:
+                self.combinados = {m: EsbocoQuantis().combinar(self.externos[m]).combinar(self.locais[m]) for m in METRICAS_COORTE}
+            esboco = self.combinados[metrica]
+            if esboco.total < MINIMO_AMOSTRAS_COORTE: return None
+            if METRICAS_COORTE[metrica]: return 100 * esboco.fracao_abaixo(valor)
+            return 100 * (1 - esboco.fracao_abaixo(valor, inclusive=True))
+
+@st.cache_resource
+def obter_coorte_saude():
+    return CoorteSaude(os.path.join(DIRETORIO_DADOS, "coorte"))
+
+def exibir_percentil_coorte(metrica, valor):
+    percentil = obter_coorte_saude().percentil(metrica, valor) if np.isfinite(valor) else None
+    if percentil is not None: st.caption(f"👥 Melhor que {percentil:.0f}% dos usuários")
+
+# --- Relatório para Exportação ---
+# O relatório é montado em uma thread separada, para não travar a página. A thread do script
+# só junta o que já foi calculado (tabelas e a imagem do gráfico em cache); a escrita é feita
+# seção por seção direto no arquivo, sem montar o documento inteiro na memória.
+FORMATOS_RELATORIO = {"PDF": ("pdf", "application/pdf"), "HTML": ("html", "text/html"), "Markdown": ("md", "text/markdown")}
+VALIDADE_RELATORIOS_SEGUNDOS = 24 * 3600
+LINHAS_POR_PAGINA_PDF = 50
+
+@st.cache_resource
+def obter_executor_relatorios():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="mentor-relatorio")
+
+def coletar_dados_relatorio():
+    dados = st.session_state.dados_financeiros
+    info_dividas = calcular_tempo_quitacao_dividas()
+    return {
+        "nome": st.session_state.nome_usuario, "gerado_em": datetime.now(),
+        "saude": calcular_saude_financeira(), "renda_mensal": dados.get("renda_mensal") or 0,
+        "despesas": [(cat, "Fixa", val) for cat, val in dados["despesas_fixas"].items()] +
+                    [(cat, "Variável", val) for cat, val in dados["despesas_variaveis"].items()],
+        "grafico_png": gerar_grafico_despesas(),
+        "tabela_dividas": montar_tabela_dividas(info_dividas), "tempo_total_meses": info_dividas["tempo_total_meses"],
+        "metas": list(dados["metas"].items()), # Metas não são alteradas depois de criadas
+        "historico": list(st.session_state.historico_consultas), # Cópia rasa: a thread não vê novos planejamentos
+    }
+
+def secoes_relatorio(dados):
+    # Gera o conteúdo como uma sequência de blocos (tipo, conteúdo), consumida por cada formato
+    saude = dados["saude"]
+    yield "texto", f"Gerado em {dados['gerado_em'].strftime('%d/%m/%Y %H:%M')} pelo Mentor Financeiro AI."
+    yield "titulo", "Diagnóstico"
+    yield "texto", (f"Score de saúde financeira: {saude['score']}/100 ({saude['classificacao']}). "
+                    f"Comprometimento de renda: {saude['comprometimento_renda']:.1f}%. Endividamento: {saude['endividamento']:.1f}%. "
+                    f"Reserva de emergência: {saude['reserva_emergencia']:.1f} meses de despesas.")
+    yield "texto", f"Renda mensal: R$ {dados['renda_mensal']:.2f}."
+    if dados["despesas"]:
+        yield "tabela", (["Despesa", "Tipo", "Valor"], [[cat, tipo, f"R$ {val:.2f}"] for cat, tipo, val in dados["despesas"]])
+    if dados["grafico_png"]: yield "imagem", dados["grafico_png"]
+    yield "titulo", "Dívidas"
+    if dados["tabela_dividas"]:
+        colunas = list(dados["tabela_dividas"][0])
+        yield "tabela", (colunas, [[linha[c] for c in colunas] for linha in dados["tabela_dividas"]])
+        if dados["tempo_total_meses"] == float('inf'): yield "texto", "Com as parcelas atuais, alguma dívida não será quitada."
+        elif dados["tempo_total_meses"]: yield "texto", f"Tempo estimado para quitar todas as dívidas: {int(dados['tempo_total_meses'])} meses."
+    else: yield "texto", "Nenhuma dívida cadastrada."
+    yield "titulo", "Metas"
+    if dados["metas"]:
+        yield "tabela", (["Meta", "Prioridade", "Valor", "Prazo", "Por mês"],
+                         [[nome, m.prioridade, f"R$ {m.valor:.2f}", f"{m.prazo_meses} meses", f"R$ {m.valor_mensal_necessario:.2f}"] for nome, m in dados["metas"]])
+    else: yield "texto", "Nenhuma meta cadastrada."
+    yield "titulo", "Planejamentos Salvos"
+    if not dados["historico"]: yield "texto", "Nenhum planejamento salvo."
+    for consulta in dados["historico"]:
+        yield "subtitulo", f"{consulta['data'].strftime('%d/%m/%Y %H:%M')} - {consulta['preocupacao']}"
+        yield "markdown", consulta["planejamento"]
+
+def escrever_relatorio_markdown(arquivo, dados):
+    arquivo.write(f"# Relatório Financeiro - {dados['nome']}\n\n")
+    for tipo, conteudo in secoes_relatorio(dados):
+        if tipo == "titulo": arquivo.write(f"## {conteudo}\n\n")
+        elif tipo == "subtitulo": arquivo.write(f"### {conteudo}\n\n")
+        elif tipo == "tabela":
+            colunas, linhas = conteudo
+            arquivo.write("| " + " | ".join(colunas) + " |\n|" + "---|" * len(colunas) + "\n")
+            for linha in linhas: arquivo.write("| " + " | ".join(str(c).replace("|", "/") for c in linha) + " |\n")
+            arquivo.write("\n")
+        elif tipo == "imagem": arquivo.write(f"![Distribuição de Despesas](data:image/png;base64,{base64.b64encode(conteudo).decode('ascii')})\n\n")
+        else: arquivo.write(f"{conteudo}\n\n")
+
+def escrever_relatorio_html(arquivo, dados):
+    arquivo.write(f"<!DOCTYPE html><html lang='pt-BR'><head><meta charset='utf-8'><title>Relatório Financeiro</title>"
+                  f"<style>body{{font-family:Roboto,sans-serif;max-width:900px;margin:auto;color:#333}}h1,h2,h3{{color:#5c1691}}"
+                  f"table{{border-collapse:collapse}}td,th{{border:1px solid #ccc;padding:4px 8px}}</style></head><body>"
+                  f"<h1>Relatório Financeiro - {html.escape(dados['nome'])}</h1>")
+    for tipo, conteudo in secoes_relatorio(dados):
+        if tipo == "titulo": arquivo.write(f"<h2>{html.escape(conteudo)}</h2>")
+        elif tipo == "subtitulo": arquivo.write(f"<h3>{html.escape(conteudo)}</h3>")
+        elif tipo == "tabela":
+            colunas, linhas = conteudo
+            arquivo.write("<table><tr>" + "".join(f"<th>{html.escape(c)}</th>" for c in colunas) + "</tr>")
+            for linha in linhas: arquivo.write("<tr>" + "".join(f"<td>{html.escape(str(c))}</td>" for c in linha) + "</tr>")
+            arquivo.write("</table>")
+        elif tipo == "imagem": arquivo.write(f"<img alt='Distribuição de Despesas' style='max-width:100%' src='data:image/png;base64,{base64.b64encode(conteudo).decode('ascii')}'>")
+        elif tipo == "markdown": arquivo.write(f"<div style='white-space:pre-wrap'>{html.escape(conteudo)}</div>")
+        else: arquivo.write(f"<p>{html.escape(conteudo)}</p>")
+    arquivo.write("</body></html>")
+
+def linhas_pdf(tipo, conteudo):
+    # Converte um bloco em linhas (texto, negrito); emojis ficam de fora porque a fonte do PDF não os tem
+    limpar = lambda texto: "".join(c for c in str(texto) if ord(c) < 0x2000).replace("**", "")
+    if tipo in ("titulo", "subtitulo"):
+        yield "", False
+        for linha in textwrap.wrap(limpar(conteudo), 90) or [""]: yield linha, True
+    elif tipo == "tabela":
+        colunas, linhas = conteudo
+        larguras = [min(28, max(len(limpar(c)) for c in [coluna] + [linha[i] for linha in linhas])) for i, coluna in enumerate(colunas)]
+        for linha in [colunas] + linhas:
+            yield " ".join(limpar(c)[:larguras[i]].ljust(larguras[i]) for i, c in enumerate(linha))[:110], linha is colunas
+    else:
+        for paragrafo in limpar(conteudo).splitlines() or [""]:
+            for linha in textwrap.wrap(paragrafo.lstrip("# "), 100) or [""]: yield linha, False
+
+def escrever_relatorio_pdf(caminho, dados):
+    linhas = []
+    with PdfPages(caminho) as pdf:
+        def salvar_pagina():
+            if not linhas: return
+            figura = Figure(figsize=(8.27, 11.69)) # A4
+            for i, (texto, negrito) in enumerate(linhas):
+                figura.text(0.06, 0.95 - i * 0.018, texto, fontsize=8, family="monospace", weight="bold" if negrito else "normal")
+            pdf.savefig(figura); linhas.clear()
+        linhas.append((f"Relatório Financeiro - {dados['nome']}", True))
+        for tipo, conteudo in secoes_relatorio(dados):
+            if tipo == "imagem":
+                salvar_pagina()
+                figura = Figure(figsize=(8.27, 11.69)); eixo = figura.add_axes([0.05, 0.35, 0.9, 0.55])
+                eixo.imshow(mpimg.imread(BytesIO(conteudo), format="png")); eixo.axis("off")
+                pdf.savefig(figura)
+                continue
+            for linha in linhas_pdf(tipo, conteudo):
+                linhas.append(linha)
+                if len(linhas) >= LINHAS_POR_PAGINA_PDF: salvar_pagina()
+        salvar_pagina()
+
+def gerar_arquivo_relatorio(dados, formato, caminho):
+    parcial = caminho + ".parcial" # Só aparece com o nome final quando estiver completo
+    if formato == "PDF": escrever_relatorio_pdf(parcial, dados)
+    else:
+        with open(parcial, "w", encoding="utf-8") as arquivo:
+            (escrever_relatorio_html if formato == "HTML" else escrever_relatorio_markdown)(arquivo, dados)
+    os.replace(parcial, caminho)
+    return caminho
+
+def iniciar_geracao_relatorio(formato):
+    diretorio = os.path.join(DIRETORIO_DADOS, "relatorios")
+    os.makedirs(diretorio, exist_ok=True)
+    remover_arquivos_expirados(diretorio, VALIDADE_RELATORIOS_SEGUNDOS) # Remove relatórios antigos
+    caminho = os.path.join(diretorio, f"{uuid.uuid4().hex}.{FORMATOS_RELATORIO[formato][0]}")
+    futuro = obter_executor_relatorios().submit(gerar_arquivo_relatorio, coletar_dados_relatorio(), formato, caminho)
+    st.session_state.relatorio = {"futuro": futuro, "formato": formato}
+
+@st.fragment(run_every=1)
+def acompanhar_geracao_relatorio():
+    # Reexecuta só este trecho a cada segundo enquanto o relatório é gerado
+    if st.session_state.relatorio["futuro"].done(): st.rerun()
+    st.info("⏳ Gerando seu relatório... você pode continuar usando o app.")
+
+def exibir_exportacao_relatorio():
+    col_formato, col_botao = st.columns([2, 1])
+    with col_formato: formato = st.selectbox("Formato do relatório", list(FORMATOS_RELATORIO), key="select_formato_relatorio")
+    with col_botao:
+        st.write("") # Alinha o botão com o seletor
+        if st.button("📄 Gerar Relatório", key="btn_gerar_relatorio", use_container_width=True):
+            iniciar_geracao_relatorio(formato)
+    relatorio = st.session_state.relatorio
+    if not relatorio: return
+    if not relatorio["futuro"].done():
+        acompanhar_geracao_relatorio()
+        return
+    try: caminho = relatorio["futuro"].result()
+    except Exception as e:
+        st.error(f"❌ Erro ao gerar o relatório: {e}")
+        return
+    if not os.path.exists(caminho): # Arquivo expirou
+        st.session_state.relatorio = None
+        return
+    extensao, tipo_mime = FORMATOS_RELATORIO[relatorio["formato"]]
+    with open(caminho, "rb") as arquivo:
+        st.download_button(f"⬇️ Baixar Relatório ({relatorio['formato']})", arquivo, key="btn_baixar_relatorio",
+                           file_name=f"relatorio_financeiro_{datetime.now().strftime('%Y%m%d')}.{extensao}", mime=tipo_mime)
+
 # --- Funções de Conteúdo Educacional (sem alterações) ---
+# Glossário embutido: usado como resposta imediata quando a IA demora ou falha
+GLOSSARIO_LOCAL = {
+    "Juros Compostos": "São juros calculados sobre o valor inicial **e** sobre os juros já acumulados: é o famoso \"juros sobre juros\". *Exemplo:* R$1.000 a 1% ao mês viram R$1.010 no 1º mês e R$1.020,10 no 2º, porque o 1% passa a incidir também sobre os R$10 de juros.",
+    "Juros Simples": "São juros calculados sempre sobre o valor inicial, sem incidir sobre os juros anteriores. *Exemplo:* R$1.000 a 1% ao mês rendem R$10 todo mês; em 12 meses, R$120.",
+    "CDI": "O Certificado de Depósito Interbancário é a taxa dos empréstimos de um dia entre bancos e anda muito perto da Selic. Serve de referência para investimentos de renda fixa. *Exemplo:* um CDB que paga \"100% do CDI\" rende praticamente a taxa CDI do período.",
+    "Selic": "É a taxa básica de juros da economia brasileira, definida pelo Banco Central (Copom). Quando sobe, crédito fica mais caro e a renda fixa rende mais; quando cai, o contrário. *Exemplo:* com a Selic alta, o Tesouro Selic rende mais.",
+    "CDB": "O Certificado de Depósito Bancário é um empréstimo que você faz ao banco em troca de juros. Tem garantia do FGC até o limite previsto. *Exemplo:* aplicar R$1.000 em um CDB de 110% do CDI por dois anos.",
+    "Tesouro Direto": "É o programa para pessoas físicas comprarem títulos públicos federais pela internet, emprestando dinheiro ao governo. *Exemplo:* o Tesouro Selic é muito usado para reserva de emergência por ter liquidez diária.",
+    "Inflação": "É o aumento generalizado dos preços ao longo do tempo, que reduz o poder de compra do dinheiro. *Exemplo:* com inflação de 5% ao ano, o que custava R$100 passa a custar cerca de R$105.",
+    "Reserva de Emergência": "É um dinheiro guardado para imprevistos, como perda de emprego ou problemas de saúde, aplicado em algo seguro e com resgate rápido. *Exemplo:* quem gasta R$3.000 por mês pode mirar de R$9.000 a R$18.000 (3 a 6 meses).",
+    "Diversificação": "É distribuir o dinheiro entre diferentes tipos de investimento para não depender de um só. *Exemplo:* parte no Tesouro, parte em CDB e parte em fundos, em vez de tudo em uma única ação.",
+    "Renda Fixa": "São investimentos com regras de rendimento definidas na aplicação, como uma taxa fixa ou um índice. *Exemplo:* Tesouro Direto, CDB, LCI e LCA.",
+    "Renda Variável": "São investimentos cujo retorno não é conhecido de antemão e pode subir ou cair. *Exemplo:* ações, fundos imobiliários e ETFs.",
+    "Ações": "São pequenas partes de uma empresa negociadas na bolsa. Quem tem ações é sócio e pode ganhar com a valorização e com os dividendos. *Exemplo:* comprar 10 ações de uma empresa a R$20 cada.",
+    "FGC": "O Fundo Garantidor de Créditos devolve o dinheiro investido em alguns produtos (como CDB e poupança) se a instituição quebrar, até R$250 mil por CPF por instituição. *Exemplo:* um CDB de R$10.000 em um banco que faliu é ressarcido pelo FGC.",
+    "IOF": "O Imposto sobre Operações Financeiras incide sobre crédito, câmbio, seguros e resgates de investimentos feitos antes de 30 dias. *Exemplo:* sacar um CDB 5 dias após aplicar faz boa parte do rendimento ir para o IOF.",
+    "IR": "O Imposto de Renda é cobrado sobre ganhos como salário e rendimentos de investimentos. Na renda fixa, a alíquota cai com o tempo (de 22,5% a 15%). *Exemplo:* um CDB resgatado após 2 anos paga 15% de IR sobre o lucro.",
+    "Previdência Privada": "É um investimento de longo prazo para complementar a aposentadoria, nos planos PGBL ou VGBL. *Exemplo:* contribuir R$300 por mês durante 25 anos para ter uma renda extra ao se aposentar.",
+    "Portabilidade de Dívida": "É o direito de levar um empréstimo ou financiamento para outro banco que ofereça juros menores, sem custo. *Exemplo:* trocar um consignado de 2,5% ao mês por outro de 1,8% ao mês em outro banco.",
+    "Score de Crédito": "É uma pontuação que indica a chance de você pagar suas contas em dia e influencia a aprovação de crédito. *Exemplo:* pagar contas em dia e manter o Cadastro Positivo ativo ajuda o score a subir.",
+    "CET (Custo Efetivo Total)": "É o custo total de um empréstimo, somando juros, tarifas, seguros e impostos. É o número certo para comparar ofertas. *Exemplo:* dois empréstimos com a mesma taxa de juros podem ter CETs diferentes por causa das tarifas.",
+    "Amortização": "É a parte da parcela que reduz de fato o saldo da dívida (o restante são juros). *Exemplo:* em uma parcela de R$500, se R$150 são juros, R$350 amortizam a dívida.",
+    "Liquidez": "É a facilidade e a rapidez de transformar um investimento em dinheiro sem perder valor. *Exemplo:* o Tesouro Selic tem alta liquidez; um imóvel tem baixa liquidez.",
+    "Rotativo do Cartão": "É o crédito usado quando você paga menos que o total da fatura; o restante vira dívida com um dos juros mais altos do mercado. *Exemplo:* pagar só o mínimo de uma fatura de R$1.000 pode fazer a dívida crescer mais de 10% no mês.",
+    "Cheque Especial": "É um limite de crédito ligado à conta corrente, usado automaticamente quando o saldo fica negativo, com juros muito altos. *Exemplo:* ficar R$500 negativo por um mês pode custar dezenas de reais em juros.",
+    "Poupança": "É uma aplicação simples e isenta de IR para pessoas físicas, mas que costuma render menos que outras opções de renda fixa. *Exemplo:* com a Selic acima de 8,5% ao ano, a poupança rende 0,5% ao mês mais a TR.",
+}
+
+# --- Índice Local do Glossário ---
+# Variantes comuns dos termos do glossário; todas levam ao nome canônico antes de consultar cache ou IA
+SINONIMOS_GLOSSARIO = {
+    "Selic": ("Taxa Selic", "Taxa Básica de Juros"),
+    "CDI": ("Certificado de Depósito Interbancário", "Taxa DI"),
+    "CDB": ("Certificado de Depósito Bancário",),
+    "CET (Custo Efetivo Total)": ("CET", "Custo Efetivo Total"),
+    "IR": ("Imposto de Renda",),
+    "IOF": ("Imposto sobre Operações Financeiras",),
+    "FGC": ("Fundo Garantidor de Créditos",),
+    "Juros Compostos": ("Juros sobre Juros",),
+    "Reserva de Emergência": ("Fundo de Emergência", "Reserva Financeira"),
+    "Rotativo do Cartão": ("Crédito Rotativo", "Rotativo"),
+    "Score de Crédito": ("Score", "Pontuação de Crédito"),
+    "Previdência Privada": ("PGBL", "VGBL", "Previdência"),
+    "Tesouro Direto": ("Títulos Públicos",),
+    "Ações": ("Ação", "Bolsa de Valores"),
+    "Poupança": ("Caderneta de Poupança",),
+}
+SIMILARIDADE_MINIMA_SUGESTAO = 0.3
+# Correção automática só para erro de digitação em uma palavra: (tamanho mínimo, distância de edição máxima)
+CORRECAO_DIGITACAO = ((9, 2), (5, 1))
+
+def normalizar_termo(texto):
+    # normalizar_texto() e, além disso, pontuação vira espaço: "CET (Custo...)" -> "cet custo..."
+    return " ".join("".join(c if c.isalnum() else " " for c in normalizar_texto(texto)).split())
+
+def distancia_edicao(a, b):
+    # Distância de Levenshtein (inserções, remoções e trocas de letra)
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        atual = [i]
+        for j, letra_b in enumerate(b, 1):
+            atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (letra_a != letra_b)))
+        anterior = atual
+    return anterior[-1]
+
+def trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceGlossario:
+    """
+    Índice das variantes normalizadas de cada termo.
+    - Autocompletar: lista ordenada com o trecho de cada variante a partir de cada início de palavra;
+      um prefixo vira uma busca binária (bisect) e uma varredura curta, como em uma trie.
+    - Busca aproximada: índice invertido de trigramas com similaridade de Dice, que tolera erros de digitação.
+    """
+    def __init__(self, variantes):
+        self.canonico = {} # variante normalizada -> termo canônico
+        for variante, termo in variantes: self.canonico.setdefault(normalizar_termo(variante), termo)
+        self.variantes = list(self.canonico)
+        entradas = sorted((variante[inicio:], inicio, indice) for indice, variante in enumerate(self.variantes)
+                          for inicio in [0] + [i + 1 for i, c in enumerate(variante) if c == " "])
+        self.trechos = [trecho for trecho, _, _ in entradas]
+        self.entradas = [(inicio, indice) for _, inicio, indice in entradas]
+        self.por_trigrama = {}
+        for indice, variante in enumerate(self.variantes):
+            for trigrama in trigramas(variante): self.por_trigrama.setdefault(trigrama, []).append(indice)
+        self.quantidade_trigramas = [len(trigramas(variante)) for variante in self.variantes]
+
+    def sugerir(self, prefixo, limite=5):
+        prefixo = normalizar_termo(prefixo)
+        if not prefixo: return []
+        inicio = bisect_left(self.trechos, prefixo)
+        fim = min(bisect_left(self.trechos, prefixo + "\uffff"), inicio + limite * 8) # Varredura limitada
+        # Começo da variante antes de começo de palavra do meio; depois, as variantes mais curtas
+        candidatos = sorted(self.entradas[inicio:fim], key=lambda e: (e[0] > 0, len(self.variantes[e[1]])))
+        sugestoes = list(dict.fromkeys(self.canonico[self.variantes[indice]] for _, indice in candidatos))[:limite]
+        return sugestoes or [termo for termo, _ in self.parecidos(prefixo, limite, SIMILARIDADE_MINIMA_SUGESTAO)]
+
+    def candidatos(self, texto, similaridade_minima):
+        # {índice da variante: similaridade de Dice} para as variantes com trigramas em comum
+        consulta = trigramas(texto)
+        comuns = {}
+        for trigrama in consulta:
+            for indice in self.por_trigrama.get(trigrama, ()): comuns[indice] = comuns.get(indice, 0) + 1
+        similaridades = {indice: 2 * quantidade / (len(consulta) + self.quantidade_trigramas[indice]) for indice, quantidade in comuns.items()}
+        return {indice: similaridade for indice, similaridade in similaridades.items() if similaridade >= similaridade_minima}
+
+    def parecidos(self, texto, limite=5, similaridade_minima=SIMILARIDADE_MINIMA_SUGESTAO):
+        melhores = {}
+        for indice, similaridade in self.candidatos(normalizar_termo(texto), similaridade_minima).items():
+            termo = self.canonico[self.variantes[indice]]
+            if similaridade > melhores.get(termo, 0): melhores[termo] = similaridade
+        return heapq.nlargest(limite, melhores.items(), key=lambda item: item[1])
+
+    def resolver(self, texto):
+        """
+        Termo canônico quando o texto é uma variante conhecida (ou um erro de digitação inequívoco
+        em uma única palavra, como "selc"); None nos demais casos, e o termo segue como digitado.
+        Semelhanças mais soltas ("Cartão de crédito" x "Score de Crédito") ficam só como sugestão.
+        """
+        normalizado = normalizar_termo(texto)
+        termo = self.canonico.get(normalizado)
+        if termo or " " in normalizado: return termo
+        distancia_maxima = next((d for tamanho, d in CORRECAO_DIGITACAO if len(normalizado) >= tamanho), 0)
+        if not distancia_maxima: return None
+        distancias = {}
+        for indice in self.candidatos(normalizado, SIMILARIDADE_MINIMA_SUGESTAO):
+            variante = self.variantes[indice]
+            if " " in variante: continue
+            distancia = distancia_edicao(normalizado, variante)
+            termo = self.canonico[variante]
+            if distancia <= distancia_maxima and distancia < distancias.get(termo, distancia_maxima + 1): distancias[termo] = distancia
+        if not distancias: return None
+        menor = min(distancias.values())
+        empatados = [termo for termo, distancia in distancias.items() if distancia == menor]
+        return empatados[0] if len(empatados) == 1 else None # Na dúvida entre dois termos, não corrige
+
+@st.cache_resource
+def carregar_indice_glossario():
+    variantes = [(termo, termo) for termo in GLOSSARIO_LOCAL]
+    variantes += [(sinonimo, termo) for termo, sinonimos in SINONIMOS_GLOSSARIO.items() for sinonimo in sinonimos]
+    return IndiceGlossario(variantes)
+
+def escolher_sugestao_glossario(termo):
+    st.session_state.input_termo_glossario = termo # Callback: roda antes de o campo ser desenhado
+
+def explicar_termo_localmente(termo):
+    termo_canonico = carregar_indice_glossario().resolver(termo)
+    if termo_canonico in GLOSSARIO_LOCAL: return GLOSSARIO_LOCAL[termo_canonico]
+    return f"Ainda estamos preparando a explicação de **{termo}**. Enquanto isso, procure por esse termo no site do Banco Central ou no Portal do Investidor da CVM."
+
+def gerar_dica_local(saude):
+    # Dica montada a partir dos indicadores, usada quando a IA não responde dentro do prazo
+    if saude["comprometimento_renda"] > 80:
+        return f"Seu orçamento está no limite: {saude['comprometimento_renda']:.0f}% da renda já tem destino. Escolha um gasto variável não essencial para cortar este mês e use a folga para respirar."
+    if saude["endividamento"] > 30:
+        return f"Suas dívidas equivalem a {saude['endividamento']:.0f}% da sua renda anual. Direcione qualquer valor extra para a dívida com os juros mais altos: cada real ali rende mais que qualquer investimento."
+    if saude["reserva_emergencia"] < 1:
+        return "Comece sua reserva de emergência hoje, nem que seja com R$20: separe o valor assim que o salário cair, antes de pagar os outros gastos."
+    if saude["comprometimento_renda"] > 60:
+        return f"Você compromete {saude['comprometimento_renda']:.0f}% da renda. Revise assinaturas e gastos recorrentes para ficar abaixo de 60% e ganhar mais tranquilidade."
+    return f"Ótimo trabalho, sua saúde financeira está {saude['classificacao'].lower()}! Que tal automatizar um investimento mensal para fazer seu dinheiro trabalhar por você?"
+
+def montar_prompt_glossario(termo):
+    return [f"Explique o termo financeiro '{termo}' de forma simples e didática para um leigo em finanças. Use no máximo 2 parágrafos e um exemplo prático. Responda em português do Brasil."]
+
 def obter_explicacao_termo_financeiro(termo):
     modelo = configurar_modelo_gemini()
     if not modelo: return "Não foi possível obter a explicação. Verifique a API Key."
     try:
-        prompt = [f"Explique o termo financeiro '{termo}' de forma simples e didática para um leigo em finanças. Use no máximo 2 parágrafos e um exemplo prático. Responda em português do Brasil."]
-        response = modelo.generate_content(prompt)
-        return response.text
-    except Exception as e: return f"Erro ao obter explicação: {e}"
+        explicacao, futuro = gerar_conteudo_com_prazo(modelo, montar_prompt_glossario(termo), TTL_GLOSSARIO, PRAZOS_RESPOSTA_SEGUNDOS["glossario"])
+    except Exception: return explicar_termo_localmente(termo) # A chamada falhou: não há o que esperar
+    if explicacao is not None: return explicacao
+    st.session_state.glossario_pendente = (termo, futuro) # Só o prazo esgotou: a explicação completa aparece quando chegar
+    return explicar_termo_localmente(termo)
 
 def gerar_dica_financeira_personalizada():
-    modelo = configurar_modelo_gemini()
-    if not modelo: return "Não foi possível gerar uma dica. Verifique a API Key."
     dados = st.session_state.dados_financeiros; saude = calcular_saude_financeira()
+    # Sem API Key a dica vem do gerador local; a barra lateral já pediu a chave nesta execução
+    modelo = configurar_modelo_gemini() if st.session_state.get("api_key_configurada") else None
+    if not modelo: return gerar_dica_local(saude)
     try:
         prompt_parts = [
             f"Gere uma dica financeira personalizada e acionável (máximo 2 frases) para alguém com:",
@@ -454,9 +1935,9 @@ def gerar_dica_financeira_personalizada():
         if saude["reserva_emergencia"] > 0: prompt_parts.append(f"- Reserva para {saude['reserva_emergencia']:.1f} meses.")
         else: prompt_parts.append("- Sem reserva de emergência.")
         prompt_parts.append("A dica deve ser motivadora. Responda em português do Brasil.")
-        response = modelo.generate_content(prompt_parts)
-        return response.text
-    except Exception as e: return f"Erro ao gerar dica: {e}"
+        dica, _ = gerar_conteudo_com_prazo(modelo, prompt_parts, TTL_DICA, PRAZOS_RESPOSTA_SEGUNDOS["dica"])
+    except Exception: dica = None
+    return dica if dica is not None else gerar_dica_local(saude)
 
 def gerar_planejamento_financeiro(preocupacao):
     modelo = configurar_modelo_gemini()
@@ -470,7 +1951,7 @@ def gerar_planejamento_financeiro(preocupacao):
         if dados['dividas']:
             prompt_parts.append("Minhas dívidas:")
             for nome_divida, info in dados['dividas'].items():
-                prompt_parts.append(f"- {nome_divida}: R${info.get('valor_total',0):.2f}, parcela R${info.get('parcela_mensal',0):.2f}, juros {info.get('taxa_juros_mensal',0):.1f}% a.m.")
+                prompt_parts.append(f"- {nome_divida}: R${info.valor_total:.2f}, parcela R${info.parcela_mensal:.2f}, juros {info.taxa_juros_mensal:.1f}% a.m.")
         prompt_parts.extend([
             "\nVocê é um consultor financeiro experiente, empático e motivador.",
             "Preciso de um plano de ação detalhado e prático para lidar com essa situação, em português do Brasil:",
@@ -481,10 +1962,14 @@ def gerar_planejamento_financeiro(preocupacao):
             "5. Dica final motivadora (1 frase).",
             "Seja claro, direto, use linguagem acessível. Formate com Markdown (negrito, listas)."
         ])
-        response = modelo.generate_content(prompt_parts)
-        st.session_state.historico_consultas.append({"data": datetime.now(), "preocupacao": preocupacao, "planejamento": response.text})
+        chave_envio = chave_idempotencia("planejamento", prompt_parts)
+        planejamento_anterior = obter_envio_recente(chave_envio)
+        if planejamento_anterior is not None: return planejamento_anterior
+        planejamento = gerar_conteudo(modelo, prompt_parts, TTL_PERSONALIZADO)
+        registrar_envio(chave_envio, planejamento) # Antes de qualquer chamada st.*, que pode ser interrompida por um novo clique
+        salvar_planejamento(preocupacao, planejamento)
         adicionar_pontos(10, "Solicitou um planejamento financeiro")
-        return response.text
+        return planejamento
     except Exception as e: return f"Erro ao gerar planejamento: {e}"
 
 def simular_negociacao_divida(credor, valor_divida, dias_atraso):
@@ -505,11 +1990,105 @@ def simular_negociacao_divida(credor, valor_divida, dias_atraso):
             "Inclua dicas entre parênteses para {nome} (ex: (Mantenha a calma), (Peça o CET)).",
             "Formate como um diálogo. Responda em português do Brasil."
         ]
-        response = modelo.generate_content(prompt_parts)
+        chave_envio = chave_idempotencia("negociacao", prompt_parts)
+        simulacao_anterior = obter_envio_recente(chave_envio)
+        if simulacao_anterior is not None: return simulacao_anterior
+        simulacao = gerar_conteudo(modelo, prompt_parts, TTL_PERSONALIZADO)
+        registrar_envio(chave_envio, simulacao)
         adicionar_pontos(15, "Realizou uma simulação de negociação")
-        return response.text
+        return simulacao
     except Exception as e: return f"Erro ao simular negociação: {e}"
 
+# --- Busca nos Planejamentos ---
+PALAVRAS_IGNORADAS_BUSCA = frozenset("""
+a o as os um uma uns umas de da do das dos em na no nas nos por para pra com sem e ou que se ao aos
+mais menos muito meu minha meus minhas seu sua seus suas eu voce isso esse essa este esta como
+""".split())
+TAMANHO_TRECHO_BUSCA = 25 # Palavras em cada trecho destacado
+
+def radical_busca(palavra):
+    # Normaliza uma palavra para o índice: sem acento, minúscula e no singular (dívidas -> divida, cartões -> cartao)
+    palavra = normalizar_texto(palavra)
+    if palavra in PALAVRAS_IGNORADAS_BUSCA: return None
+    if len(palavra) <= 3: return palavra
+    if palavra.endswith(("oes", "aes")): return palavra[:-3] + "ao"
+    if palavra.endswith("ns"): return palavra[:-2] + "m"
+    if palavra.endswith(("res", "zes")): return palavra[:-2]
+    return palavra[:-1] if palavra.endswith("s") else palavra
+
+def palavras_busca(texto):
+    # (radical, início, fim) de cada palavra relevante; as posições valem para o texto original
+    for palavra in re.finditer(r"\w+", texto):
+        radical = radical_busca(palavra.group())
+        if radical: yield radical, palavra.start(), palavra.end()
+
+def texto_planejamento(consulta):
+    return f"{consulta['preocupacao']}\n{consulta['planejamento']}"
+
+class IndicePlanejamentos:
+    """
+    Índice invertido dos planejamentos salvos: radical -> {planejamento: (frequência, posição da 1ª ocorrência)}.
+    Cada planejamento novo é indexado uma única vez; a busca só visita as listas dos radicais pedidos,
+    ordena por BM25 e monta os trechos apenas dos resultados exibidos, a partir da posição guardada.
+    """
+    def __init__(self):
+        self.listas = {}
+        self.tamanhos = [] # Palavras relevantes de cada planejamento, na ordem do histórico
+
+    def adicionar(self, texto):
+        documento = len(self.tamanhos); ocorrencias = {}
+        for radical, inicio, _ in palavras_busca(texto):
+            frequencia, primeira = ocorrencias.get(radical, (0, inicio))
+            ocorrencias[radical] = (frequencia + 1, primeira)
+        for radical, ocorrencia in ocorrencias.items(): self.listas.setdefault(radical, {})[documento] = ocorrencia
+        self.tamanhos.append(sum(frequencia for frequencia, _ in ocorrencias.values()))
+
+    def buscar(self, consulta, limite=10, k1=1.2, b=0.75):
+        # [(planejamento, pontuação, posição para o trecho)], do mais relevante para o menos
+        radicais = {radical for radical, _, _ in palavras_busca(consulta)}
+        total = len(self.tamanhos)
+        if not radicais or not total: return []
+        tamanho_medio = sum(self.tamanhos) / total
+        pontuacoes = {}; posicoes = {}
+        for radical in sorted(radicais, key=lambda r: len(self.listas.get(r, ()))): # Do mais raro ao mais comum
+            lista = self.listas.get(radical)
+            if not lista: continue
+            idf = math.log(1 + (total - len(lista) + 0.5) / (len(lista) + 0.5))
+            for documento, (frequencia, primeira) in lista.items():
+                normalizacao = k1 * (1 - b + b * self.tamanhos[documento] / tamanho_medio)
+                pontuacoes[documento] = pontuacoes.get(documento, 0) + idf * frequencia * (k1 + 1) / (frequencia + normalizacao)
+                posicoes.setdefault(documento, primeira)
+        melhores = heapq.nlargest(limite, pontuacoes.items(), key=lambda item: (item[1], item[0]))
+        return [(documento, pontuacao, posicoes[documento]) for documento, pontuacao in melhores]
+
+    def serializar(self):
+        return {"tamanhos": self.tamanhos, "listas": {r: [[d, f, p] for d, (f, p) in l.items()] for r, l in self.listas.items()}}
+
+    @classmethod
+    def desserializar(cls, dados):
+        indice = cls(); indice.tamanhos = dados["tamanhos"]
+        indice.listas = {r: {d: (f, p) for d, f, p in l} for r, l in dados["listas"].items()}
+        return indice
+
+def indexar_historico(historico):
+    indice = IndicePlanejamentos()
+    for consulta in historico: indice.adicionar(texto_planejamento(consulta))
+    return indice
+
+def salvar_planejamento(preocupacao, planejamento):
+    consulta = {"data": datetime.now(), "preocupacao": preocupacao, "planejamento": planejamento}
+    st.session_state.historico_consultas.append(consulta)
+    st.session_state.indice_planejamentos.adicionar(texto_planejamento(consulta))
+
+def trecho_destacado(texto, posicao, consulta):
+    # Trecho em Markdown ao redor da posição, com as palavras buscadas em negrito; só lê essa janela do texto
+    radicais = {radical for radical, _, _ in palavras_busca(consulta)}
+    inicio = max(0, texto.rfind(" ", 0, max(0, posicao - TAMANHO_TRECHO_BUSCA * 3)) + 1)
+    janela = texto[inicio:posicao + TAMANHO_TRECHO_BUSCA * 6]
+    palavras = re.sub(r"[*_#`>|\[\]]", "", janela).split()[:TAMANHO_TRECHO_BUSCA]
+    destacadas = [f"**{p}**" if radical_busca(p.strip(".,;:!?()\"'")) in radicais else p for p in palavras]
+    return ("…" if inicio > 0 else "") + " ".join(destacadas) + ("…" if inicio + len(janela) < len(texto) else "")
+
 # --- Componentes da Interface (sem grandes alterações, exceto talvez chaves de botões se necessário) ---
 def exibir_cabecalho():
     col1, col2 = st.columns([3, 1])
@@ -560,6 +2139,47 @@ def exibir_barra_lateral():
     st.sidebar.markdown("---")
     st.sidebar.info("Mentor Financeiro AI\n\nDesenvolvido para fins educacionais. Conteúdo de IA pode conter erros. Procure ajuda profissional.")
 
+# --- Listas Paginadas ---
+# Listas que crescem com o uso são exibidas em páginas, cada uma em um único
+# elemento, para que o custo de cada rerun não dependa do total de itens.
+TAMANHO_PAGINA = 20
+
+def selecionar_pagina(total_itens, chave, tamanho_pagina=TAMANHO_PAGINA):
+    """Exibe o seletor de página (quando há mais de uma) e retorna o intervalo (inicio, fim) da página atual."""
+    total_paginas = max(1, -(-total_itens // tamanho_pagina))
+    pagina = 1
+    if total_paginas > 1:
+        pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1, step=1, key=chave)
+    inicio = (pagina - 1) * tamanho_pagina
+    return inicio, min(inicio + tamanho_pagina, total_itens)
+
+def exibir_tabela_selecionavel(registros, montar_linha, chave):
+    """
+    Exibe um dicionário nome -> info como uma única tabela paginada com seleção de linhas.
+    Retorna os nomes das linhas selecionadas na página atual.
+    """
+    inicio, fim = selecionar_pagina(len(registros), f"pag_{chave}")
+    pagina = list(islice(registros.items(), inicio, fim))
+    # A seleção guarda índices de linha e o ID da tabela não depende dos dados: a versão na chave
+    # (trocada a cada remoção) cria uma tabela nova, sem linhas que agora apontariam para outros itens
+    versao = st.session_state.versoes_tabelas.get(chave, 0)
+    selecao = st.dataframe(pd.DataFrame([montar_linha(nome, info) for nome, info in pagina]),
+                           hide_index=True, use_container_width=True, on_select="rerun",
+                           selection_mode="multi-row", key=f"tabela_{chave}_{versao}_{inicio}")
+    return [pagina[i][0] for i in selecao.selection.rows if i < len(pagina)]
+
+def remover_selecionadas(registros, nomes, chave):
+    for nome in nomes: del registros[nome]
+    st.session_state.versoes_tabelas[chave] = st.session_state.versoes_tabelas.get(chave, 0) + 1
+
+def exibir_despesas_cadastradas(tipo):
+    despesas = st.session_state.dados_financeiros[tipo]
+    selecionadas = exibir_tabela_selecionavel(despesas, lambda cat, val: {"Despesa": cat, "Valor (R$)": round(val, 2)}, tipo)
+    st.markdown(f"**Total: R$ {sum(despesas.values()):.2f}**")
+    if selecionadas and st.button(f"Remover {len(selecionadas)} selecionada(s)", key=f"btn_rem_sel_{tipo}", type="secondary"):
+        remover_selecionadas(despesas, selecionadas, tipo)
+        st.rerun()
+
 # --- Páginas da Aplicação ---
 def pagina_boas_vindas():
     st.markdown("## 👋 Bem-vindo ao Mentor Financeiro AI!")
@@ -575,9 +2195,7 @@ def pagina_boas_vindas():
         if nome:
             st.session_state.nome_usuario = nome
             st.session_state.pagina_atual = "dashboard"
-            if "Início da Jornada Financeira! 🚀" not in st.session_state.conquistas:
-                 adicionar_conquista("Início da Jornada Financeira! 🚀")
-                 adicionar_pontos(10, "Iniciou sua jornada financeira")
+            registrar_evento("jornada_iniciada")
             st.success(f"Olá, {nome}! Bem-vindo à sua jornada financeira!")
             st.balloons()
             time.sleep(1) # Pequena pausa para o usuário ver a mensagem
@@ -601,28 +2219,36 @@ def pagina_dashboard():
         return
 
     saude = calcular_saude_financeira()
+    registrar_evento("saude_avaliada", **saude)
+    registrar_snapshot_saude(saude)
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric(label="Comprometimento de Renda", value=f"{saude['comprometimento_renda']:.1f}%", 
                   help="Ideal abaixo de 60-70%. Percentual da sua renda usado para pagar todas as despesas e dívidas.")
+        exibir_percentil_coorte("comprometimento_renda", saude['comprometimento_renda'])
         if saude['comprometimento_renda'] > 80: st.error("⚠️ Acima do recomendado (80%)")
         elif saude['comprometimento_renda'] > 60: st.warning("⚠️ Atenção! Próximo do limite")
         else: st.success("✅ Dentro do recomendado")
     with col2:
         st.metric(label="Nível de Endividamento Total", value=f"{saude['endividamento']:.1f}%",
                   help="Ideal abaixo de 30-40% do seu patrimônio ou renda anual. Relação entre o total de suas dívidas e sua renda anual.")
+        exibir_percentil_coorte("endividamento", saude['endividamento'])
         if saude['endividamento'] > 50: st.error("⚠️ Endividamento elevado")
         elif saude['endividamento'] > 30: st.warning("⚠️ Endividamento moderado")
         else: st.success("✅ Endividamento controlado")
     with col3:
         st.metric(label="Score de Saúde Financeira", value=f"{saude['score']}/100", delta=f"{saude['classificacao']}")
+        exibir_percentil_coorte("score", saude['score'])
         if saude['score'] >= 80: st.success(f"Classificação: {saude['classificacao']}")
         elif saude['score'] >= 40: st.warning(f"Classificação: {saude['classificacao']}")
         else: st.error(f"Classificação: {saude['classificacao']}")
 
+    st.markdown("### 📈 Evolução da Sua Saúde Financeira")
+    exibir_evolucao_saude()
+
     st.markdown("### Distribuição de Despesas")
     grafico = gerar_grafico_despesas()
-    if grafico: st.pyplot(grafico)
+    if grafico: st.image(grafico)
     else: st.info("Adicione suas despesas no diagnóstico para visualizar o gráfico.")
 
     st.markdown("### Situação das Dívidas")
@@ -640,19 +2266,17 @@ def pagina_dashboard():
         st.markdown(f"**Método de quitação recomendado:** {metodo['metodo']}")
         st.markdown(f"*{metodo['explicacao']}*")
         
-        dados_tabela_div = []
-        for nome, info in info_dividas["dividas"].items():
-            div_orig = st.session_state.dados_financeiros["dividas"][nome]
-            tempo_str = f"{int(info['tempo_meses'] // 12)}a {int(info['tempo_meses'] % 12)}m" if info['tempo_meses'] != float('inf') and info['tempo_meses'] > 0 else ("Nunca" if info['tempo_meses'] == float('inf') else "N/A")
-            dados_tabela_div.append({
-                "Dívida": nome, "Valor Total": f"R$ {div_orig.get('valor_total',0):.2f}", 
-                "Parcela": f"R$ {div_orig.get('parcela_mensal',0):.2f}", "Juros (% a.m.)": f"{div_orig.get('taxa_juros_mensal',0):.2f}",
-                "Tempo p/ Quitar": tempo_str, "Total de Juros Pago": f"R$ {info.get('total_juros',0):.2f}"
-            })
+        dados_tabela_div = montar_tabela_dividas(info_dividas)
         if dados_tabela_div: st.dataframe(pd.DataFrame(dados_tabela_div), hide_index=True, use_container_width=True)
+
+        st.markdown("#### 🎚️ E se...?")
+        exibir_simulador_e_se()
     else:
         st.success("✅ Você não possui dívidas cadastradas.")
 
+    st.markdown("### 🧮 Plano para a Sua Sobra Mensal")
+    exibir_plano_sobra()
+
     st.markdown("### Dica Personalizada do Mentor AI")
     with st.spinner("Gerando sua dica personalizada..."):
         dica = gerar_dica_financeira_personalizada()
@@ -661,13 +2285,16 @@ def pagina_dashboard():
     if st.session_state.desafios_ativos:
         st.markdown("### Seus Desafios Ativos")
         for desafio in st.session_state.desafios_ativos:
-            dias_restantes = (desafio["data_fim"] - datetime.now()).days
             st.markdown(f"""
             <div class="challenge-card" style='border-left: 5px solid #5c1691;'>
-                <h4>{desafio['titulo']}</h4> <p>{desafio['descricao']}</p>
-                <p><strong>Dificuldade:</strong> {desafio['dificuldade']} | <strong>Pontos:</strong> {desafio['pontos']} | <strong>Restam:</strong> {max(0, dias_restantes)} dias</p>
+                <h4>{desafio.titulo}</h4> <p>{desafio.descricao}</p>
+                <p><strong>Dificuldade:</strong> {desafio.dificuldade} | <strong>Pontos:</strong> {desafio.pontos} | <strong>Restam:</strong> {desafio.dias_restantes()} dias</p>
             </div>""", unsafe_allow_html=True)
 
+    st.markdown("### 📄 Exportar Relatório")
+    st.caption("Diagnóstico, tabela de quitação, gráfico de despesas e planejamentos salvos em um só arquivo.")
+    exibir_exportacao_relatorio()
+
 def pagina_consultor():
     st.markdown("## 💬 Consultor Virtual Inteligente")
     st.markdown("<div class='info-box'><p>Use a inteligência artificial para obter planejamentos, simular negociações e entender termos financeiros.</p></div>", unsafe_allow_html=True)
@@ -687,10 +2314,21 @@ def pagina_consultor():
                 st.markdown(f"<div class='success-box'>{planejamento}</div>", unsafe_allow_html=True)
             else: st.error("Por favor, descreva sua preocupação ou objetivo.")
         if st.session_state.historico_consultas:
+            historico = st.session_state.historico_consultas
             st.markdown("--- \n### Histórico de Planejamentos")
-            for i, consulta in enumerate(reversed(st.session_state.historico_consultas[-3:])): # Mostrar os 3 últimos
-                with st.expander(f"Planejamento de {consulta['data'].strftime('%d/%m/%Y %H:%M')} - Foco: {consulta['preocupacao'][:30]}..."):
-                    st.markdown(consulta['planejamento'])
+            busca = st.text_input(f"🔎 Buscar nos seus {len(historico)} planejamentos:", placeholder="Ex: cartão de crédito, reserva, viagem", key="input_busca_planejamentos")
+            if busca:
+                resultados = st.session_state.indice_planejamentos.buscar(busca)
+                if not resultados: st.info("Nenhum planejamento encontrado com essas palavras.")
+                for documento, _, posicao in resultados:
+                    consulta = historico[documento]
+                    st.markdown(f"**{consulta['data'].strftime('%d/%m/%Y %H:%M')}** · {trecho_destacado(texto_planejamento(consulta), posicao, busca)}")
+                    with st.expander(f"Ver planejamento completo - Foco: {consulta['preocupacao'][:60]}"):
+                        st.markdown(consulta['planejamento'])
+            else:
+                for i, consulta in enumerate(reversed(historico[-3:])): # Mostrar os 3 últimos
+                    with st.expander(f"Planejamento de {consulta['data'].strftime('%d/%m/%Y %H:%M')} - Foco: {consulta['preocupacao'][:30]}..."):
+                        st.markdown(consulta['planejamento'])
     with tab2:
         st.markdown("### Simulador de Negociação de Dívidas")
         st.markdown("Prepare-se para conversas reais com credores simulando uma negociação aqui.")
@@ -710,14 +2348,41 @@ def pagina_consultor():
         termos_comuns = ["Juros Compostos", "CDI", "Selic", "CDB", "Tesouro Direto", "Inflação", "Reserva de Emergência", "Diversificação", "Renda Fixa", "Renda Variável", "Ações", "FGC", "IOF", "IR", "Previdência Privada", "Portabilidade de Dívida", "Score de Crédito", "CET (Custo Efetivo Total)"]
         termo_selecionado = st.selectbox("Selecione um termo comum:", options=[""] + sorted(termos_comuns), index=0, key="select_termo_glossario")
         termo_digitado = st.text_input("Ou digite um termo para buscar:", placeholder="Ex: Amortização", key="input_termo_glossario")
-        termo_final = termo_digitado if termo_digitado else termo_selecionado
+        indice_glossario = carregar_indice_glossario()
+        if termo_digitado:
+            sugestoes = [s for s in indice_glossario.sugerir(termo_digitado) if normalizar_termo(s) != normalizar_termo(termo_digitado)]
+            if sugestoes:
+                st.caption("Sugestões:")
+                for coluna, sugestao in zip(st.columns(len(sugestoes)), sugestoes):
+                    with coluna: st.button(sugestao, key=f"btn_sugestao_glossario_{sugestao}", on_click=escolher_sugestao_glossario, args=(sugestao,))
+        termo_final = (termo_digitado if termo_digitado else termo_selecionado).strip()
         if st.button("🔍 Explicar Termo", key="btn_explicar_termo"):
             if termo_final:
-                with st.spinner(f"Buscando explicação para '{termo_final}'..."):
-                    explicacao = obter_explicacao_termo_financeiro(termo_final)
+                termo_canonico = indice_glossario.resolver(termo_final)
+                if termo_canonico and termo_canonico != termo_final:
+                    st.caption(f"🔎 Mostrando resultado para **{termo_canonico}** (você digitou '{termo_final}').")
+                    termo_final = termo_canonico
+                chave_envio = chave_idempotencia("glossario", normalizar_texto(termo_final))
+                explicacao = obter_envio_recente(chave_envio)
+                envio_repetido = explicacao is not None
+                if not envio_repetido:
+                    with st.spinner(f"Buscando explicação para '{termo_final}'..."):
+                        explicacao = obter_explicacao_termo_financeiro(termo_final)
+                    registrar_envio(chave_envio, explicacao)
                 st.markdown(f"<div class='info-box'><h4>{termo_final}</h4>{explicacao}</div>", unsafe_allow_html=True)
-                adicionar_pontos(5, f"Aprendeu sobre {termo_final}")
+                if not envio_repetido:
+                    adicionar_pontos(5, f"Aprendeu sobre {termo_final}")
+                    registrar_evento("termo_aprendido", termo=normalizar_texto(termo_final))
             else: st.error("Selecione ou digite um termo.")
+        if st.session_state.glossario_pendente:
+            # Resposta local exibida antes; troca pela da IA assim que a chamada em segundo plano terminar
+            termo_pendente, futuro = st.session_state.glossario_pendente
+            if not futuro.done(): st.caption(f"⏳ A explicação completa de '{termo_pendente}' está a caminho e aparecerá aqui na próxima interação.")
+            else:
+                st.session_state.glossario_pendente = None
+                if futuro.exception() is None:
+                    st.markdown(f"<div class='info-box'><h4>{termo_pendente} (explicação completa)</h4>{futuro.result()}</div>", unsafe_allow_html=True)
+                else: st.caption(f"⚠️ Não foi possível obter a explicação completa de '{termo_pendente}' agora. Tente de novo mais tarde.")
 
 def pagina_diagnostico():
     st.markdown("## 📝 Diagnóstico Financeiro")
@@ -736,6 +2401,7 @@ def pagina_diagnostico():
             st.session_state.dados_financeiros["renda_mensal"] = renda_mensal
             st.session_state.dados_financeiros["reserva_emergencia"] = reserva_emergencia
             st.success("✅ Renda e reserva salvas!")
+            registrar_snapshot_saude(calcular_saude_financeira(), forcar=True)
             if not st.session_state.diagnostico_realizado and renda_mensal > 0:
                 adicionar_pontos(10, "Informou sua renda no diagnóstico")
 
@@ -759,15 +2425,11 @@ def pagina_diagnostico():
         col_fixas, col_variaveis = st.columns(2)
         with col_fixas:
             st.markdown("#### Despesas Fixas Cadastradas")
-            if st.session_state.dados_financeiros["despesas_fixas"]:
-                for cat, val in st.session_state.dados_financeiros["despesas_fixas"].items(): st.write(f"- {cat}: R$ {val:.2f}")
-                st.markdown(f"**Total Fixas: R$ {sum(st.session_state.dados_financeiros['despesas_fixas'].values()):.2f}**")
+            if st.session_state.dados_financeiros["despesas_fixas"]: exibir_despesas_cadastradas("despesas_fixas")
             else: st.caption("Nenhuma despesa fixa.")
         with col_variaveis:
             st.markdown("#### Despesas Variáveis Cadastradas")
-            if st.session_state.dados_financeiros["despesas_variaveis"]:
-                for cat, val in st.session_state.dados_financeiros["despesas_variaveis"].items(): st.write(f"- {cat}: R$ {val:.2f}")
-                st.markdown(f"**Total Variáveis: R$ {sum(st.session_state.dados_financeiros['despesas_variaveis'].values()):.2f}**")
+            if st.session_state.dados_financeiros["despesas_variaveis"]: exibir_despesas_cadastradas("despesas_variaveis")
             else: st.caption("Nenhuma despesa variável.")
         if st.button("🗑️ Limpar Todas as Despesas", key="btn_limpar_td_despesas", type="secondary"):
             st.session_state.dados_financeiros["despesas_fixas"] = {}
@@ -790,24 +2452,23 @@ def pagina_diagnostico():
 
             if submit_divida:
                 if nome_divida and valor_total_div > 0:
-                    st.session_state.dados_financeiros["dividas"][nome_divida] = {
-                        "valor_total": valor_total_div, "parcela_mensal": parcela_mensal_div,
-                        "taxa_juros_mensal": taxa_juros_div, 
-                        "total_parcelas": total_parcelas_div if total_parcelas_div > 0 else None
-                    }
+                    st.session_state.dados_financeiros["dividas"][nome_divida] = Divida(
+                        valor_total_div, parcela_mensal_div, taxa_juros_div, total_parcelas_div or None)
                     st.success(f"Dívida '{nome_divida}' adicionada!")
                     # st.rerun() # Para limpar form, mas pode ser chato
                 else: st.error("Preencha nome e valor total da dívida.")
         
         if st.session_state.dados_financeiros["dividas"]:
             st.markdown("#### Dívidas Cadastradas")
-            for nome, info in st.session_state.dados_financeiros["dividas"].items():
-                exp = st.expander(f"{nome} - Saldo: R$ {info.get('valor_total',0):.2f} / Parcela: R$ {info.get('parcela_mensal',0):.2f}")
-                exp.write(f"Juros: {info.get('taxa_juros_mensal',0):.2f}% a.m. | Parcelas Restantes: {info.get('total_parcelas','N/A')}")
-                if exp.button(f"Remover {nome}", key=f"rem_div_{nome.replace(' ','_')}", type="secondary"):
-                    del st.session_state.dados_financeiros["dividas"][nome]
-                    st.success(f"Dívida '{nome}' removida.")
-                    st.rerun()
+            st.caption("Selecione linhas da tabela para removê-las.")
+            selecionadas = exibir_tabela_selecionavel(st.session_state.dados_financeiros["dividas"], lambda nome, info: {
+                "Dívida": nome, "Saldo (R$)": round(info.valor_total, 2), "Parcela (R$)": round(info.parcela_mensal, 2),
+                "Juros (% a.m.)": round(info.taxa_juros_mensal, 2), "Parcelas Restantes": info.total_parcelas
+            }, "dividas")
+            if selecionadas and st.button(f"Remover {len(selecionadas)} dívida(s) selecionada(s)", key="btn_rem_dividas_sel", type="secondary"):
+                remover_selecionadas(st.session_state.dados_financeiros["dividas"], selecionadas, "dividas")
+                st.success(f"Dívida(s) removida(s): {', '.join(selecionadas)}")
+                st.rerun()
         else: st.caption("Nenhuma dívida cadastrada.")
 
     # Aba de Metas
@@ -823,27 +2484,23 @@ def pagina_diagnostico():
 
             if submit_meta:
                 if nome_meta and valor_meta > 0 and prazo_meta_meses > 0:
-                    st.session_state.dados_financeiros["metas"][nome_meta] = {
-                        "valor": valor_meta, "prazo_meses": prazo_meta_meses, "prioridade": prioridade_meta,
-                        "valor_mensal_necessario": valor_meta / prazo_meta_meses, "data_criacao": datetime.now().strftime("%d/%m/%Y")
-                    }
+                    st.session_state.dados_financeiros["metas"][nome_meta] = Meta(valor_meta, prazo_meta_meses, prioridade_meta)
                     st.success(f"Meta '{nome_meta}' adicionada!")
-                    if len(st.session_state.dados_financeiros["metas"]) == 1 and "Primeira Meta Definida! 🎯" not in st.session_state.conquistas:
-                        adicionar_pontos(15, "Definiu sua primeira meta financeira")
-                        adicionar_conquista("Primeira Meta Definida! 🎯")
+                    registrar_evento("meta_criada")
                     # st.rerun()
                 else: st.error("Preencha todos os campos da meta.")
 
         if st.session_state.dados_financeiros["metas"]:
             st.markdown("#### Metas Cadastradas")
-            for nome, info in st.session_state.dados_financeiros["metas"].items():
-                exp = st.expander(f"{info['prioridade']} - {nome} (R$ {info['valor']:.2f} em {info['prazo_meses']} meses)")
-                exp.write(f"Necessário poupar/investir: R$ {info['valor_mensal_necessario']:.2f}/mês")
-                exp.caption(f"Criada em: {info['data_criacao']}")
-                if exp.button(f"Remover Meta {nome}", key=f"rem_meta_{nome.replace(' ','_')}", type="secondary"):
-                    del st.session_state.dados_financeiros["metas"][nome]
-                    st.success(f"Meta '{nome}' removida.")
-                    st.rerun()
+            st.caption("Selecione linhas da tabela para removê-las.")
+            selecionadas = exibir_tabela_selecionavel(st.session_state.dados_financeiros["metas"], lambda nome, info: {
+                "Prioridade": info.prioridade, "Meta": nome, "Valor (R$)": round(info.valor, 2), "Prazo (meses)": info.prazo_meses,
+                "Poupar por Mês (R$)": round(info.valor_mensal_necessario, 2), "Criada em": info.data_criacao
+            }, "metas")
+            if selecionadas and st.button(f"Remover {len(selecionadas)} meta(s) selecionada(s)", key="btn_rem_metas_sel", type="secondary"):
+                remover_selecionadas(st.session_state.dados_financeiros["metas"], selecionadas, "metas")
+                st.success(f"Meta(s) removida(s): {', '.join(selecionadas)}")
+                st.rerun()
         else: st.caption("Nenhuma meta cadastrada.")
 
     st.markdown("---")
@@ -852,9 +2509,12 @@ def pagina_diagnostico():
             st.error("Por favor, informe sua renda mensal na aba 'Renda' para finalizar.")
         else:
             st.session_state.diagnostico_realizado = True
-            if "Diagnóstico Completo! 📊" not in st.session_state.conquistas:
-                adicionar_pontos(30, "Completou o diagnóstico financeiro")
-                adicionar_conquista("Diagnóstico Completo! 📊")
+            registrar_evento("diagnostico_concluido")
+            saude = calcular_saude_financeira()
+            registrar_snapshot_saude(saude, forcar=True)
+            if not st.session_state.contribuiu_coorte: # Uma amostra por sessão: os esboços não removem valores antigos
+                obter_coorte_saude().registrar(saude) # Entra na comparação anônima com os outros usuários
+                st.session_state.contribuiu_coorte = True
             st.success("✅ Diagnóstico financeiro concluído! Redirecionando para o Dashboard...")
             st.balloons()
             time.sleep(1)
@@ -887,10 +2547,10 @@ def pagina_desafios():
         with st.container():
             st.markdown(f"""
             <div class="challenge-card" style="background-color: #a225f5; border-left: 5px solid #c97ffa;">
-                <h4 style="color: #f7f7f7;">{desafio['titulo']}</h4>
-                <p>{desafio['descricao']}</p>
-                <p><strong>Dificuldade:</strong> {desafio['dificuldade']} | <strong>Pontos:</strong> {desafio['pontos']}</p>
-                <p><strong>Duração:</strong> {desafio['duracao_dias']} dias</p>
+                <h4 style="color: #f7f7f7;">{desafio.titulo}</h4>
+                <p>{desafio.descricao}</p>
+                <p><strong>Dificuldade:</strong> {desafio.dificuldade} | <strong>Pontos:</strong> {desafio.pontos}</p>
+                <p><strong>Duração:</strong> {desafio.duracao_dias} dias</p>
             </div>
             """, unsafe_allow_html=True)
 
@@ -899,12 +2559,12 @@ def pagina_desafios():
             col_aceitar, col_recusar = st.columns(2)
             with col_aceitar:
                 # Chave única para o botão de aceitar, baseada no título para evitar conflitos
-                if st.button("✅ Aceitar Este Desafio!", key=f"aceitar_desafio_{desafio['titulo'].replace(' ', '_')}", use_container_width=True):
+                if st.button("✅ Aceitar Este Desafio!", key=f"aceitar_desafio_{desafio.titulo.replace(' ', '_')}", use_container_width=True):
                     aceitar_desafio(st.session_state.desafio_proposto)
                     st.session_state.desafio_proposto = None  # Limpa o desafio proposto após aceitar
                     st.rerun() # Atualiza a UI para mover o desafio para a lista de ativos
             with col_recusar:
-                if st.button("❌ Recusar/Gerar Outro", key=f"recusar_desafio_{desafio['titulo'].replace(' ', '_')}", type="secondary", use_container_width=True):
+                if st.button("❌ Recusar/Gerar Outro", key=f"recusar_desafio_{desafio.titulo.replace(' ', '_')}", type="secondary", use_container_width=True):
                     st.session_state.desafio_proposto = None # Limpa o desafio proposto
                     st.info("Desafio recusado. Você pode gerar um novo.")
                     st.rerun() # Para limpar o desafio recusado da tela
@@ -914,27 +2574,25 @@ def pagina_desafios():
     if st.session_state.desafios_ativos:
         st.markdown("### 👊 Seus Desafios Ativos")
         for i, desafio_ativo in enumerate(st.session_state.desafios_ativos):
-            dias_restantes = (desafio_ativo["data_fim"] - datetime.now()).days
-            
-            with st.expander(f"{desafio_ativo['titulo']} (Restam: {max(0, dias_restantes)} dias | Pontos: {desafio_ativo['pontos']})"):
-                st.markdown(f"**Descrição:** {desafio_ativo['descricao']}")
-                st.markdown(f"**Dificuldade:** {desafio_ativo['dificuldade']}")
-                st.markdown(f"**Início:** {desafio_ativo['data_inicio'].strftime('%d/%m/%Y')} | **Término:** {desafio_ativo['data_fim'].strftime('%d/%m/%Y')}")
+            with st.expander(f"{desafio_ativo.titulo} (Restam: {desafio_ativo.dias_restantes()} dias | Pontos: {desafio_ativo.pontos})"):
+                st.markdown(f"**Descrição:** {desafio_ativo.descricao}")
+                st.markdown(f"**Dificuldade:** {desafio_ativo.dificuldade}")
+                st.markdown(f"**Início:** {desafio_ativo.data_inicio.strftime('%d/%m/%Y')} | **Término:** {desafio_ativo.data_fim.strftime('%d/%m/%Y')}")
                 
                 # Botões para concluir ou abandonar desafio ativo
                 # Usar chaves únicas e distintas das do desafio proposto
                 col_btn_concluir, col_btn_abandonar = st.columns(2)
                 with col_btn_concluir:
-                    if st.button(f"✔️ Marcar como Concluído", key=f"btn_concluir_ativo_{i}_{desafio_ativo['titulo'].replace(' ', '_')}", use_container_width=True):
+                    if st.button(f"✔️ Marcar como Concluído", key=f"btn_concluir_ativo_{i}_{desafio_ativo.titulo.replace(' ', '_')}", use_container_width=True):
                         concluir_desafio(i)
                         st.rerun()
                 with col_btn_abandonar:
-                    if st.button(f"🏳️ Abandonar Desafio", key=f"btn_abandonar_ativo_{i}_{desafio_ativo['titulo'].replace(' ', '_')}", type="secondary", use_container_width=True):
-                        titulo_abandonado = st.session_state.desafios_ativos[i]['titulo']
+                    if st.button(f"🏳️ Abandonar Desafio", key=f"btn_abandonar_ativo_{i}_{desafio_ativo.titulo.replace(' ', '_')}", type="secondary", use_container_width=True):
+                        titulo_abandonado = st.session_state.desafios_ativos[i].titulo
                         st.session_state.desafios_ativos.pop(i)
                         st.warning(f"Desafio '{titulo_abandonado}' abandonado.")
                         # Se o desafio abandonado era o mesmo que estava proposto (caso raro), limpar o proposto.
-                        if st.session_state.desafio_proposto and st.session_state.desafio_proposto['titulo'] == titulo_abandonado:
+                        if st.session_state.desafio_proposto and st.session_state.desafio_proposto.titulo == titulo_abandonado:
                             st.session_state.desafio_proposto = None
                         st.rerun()
     else:
@@ -943,15 +2601,20 @@ def pagina_desafios():
     st.markdown("---")
     # Exibir desafios concluídos
     if st.session_state.desafios_concluidos:
-        st.markdown("### 🎉 Desafios Concluídos")
-        for desafio_concluido in reversed(st.session_state.desafios_concluidos): # Mostrar mais recentes primeiro
-            st.markdown(f"""
+        st.markdown(f"### 🎉 Desafios Concluídos ({st.session_state.total_desafios_concluidos})")
+        concluidos = st.session_state.desafios_concluidos
+        inicio, fim = selecionar_pagina(len(concluidos), "pag_desafios_concluidos", tamanho_pagina=10)
+        # Mais recentes primeiro; a página inteira vai em um único bloco HTML
+        pagina = concluidos[len(concluidos) - fim:len(concluidos) - inicio][::-1]
+        st.markdown("".join(f"""
             <div class="success-box" style='border-left: 5px solid #4caf50;'>
-                <h4>{desafio_concluido['titulo']} ✅</h4>
-                <p>{desafio_concluido['descricao']}</p>
-                <p><strong>Pontos ganhos:</strong> {desafio_concluido['pontos']}</p>
+                <h4>{desafio_concluido.titulo} ✅</h4>
+                <p>{desafio_concluido.descricao}</p>
+                <p><strong>Pontos ganhos:</strong> {desafio_concluido.pontos}</p>
             </div>
-            """, unsafe_allow_html=True)
+            """ for desafio_concluido in pagina), unsafe_allow_html=True)
+        if st.session_state.total_desafios_concluidos > len(concluidos):
+            st.caption(f"Exibindo os {len(concluidos)} desafios concluídos mais recentes.")
 
 def pagina_educacional():
     st.markdown("## 📚 Conteúdo Educacional")
@@ -1014,36 +2677,35 @@ def pagina_conquistas():
     st.markdown("--- \n### Estatísticas Gerais")
     col_stats1, col_stats2, col_stats3 = st.columns(3)
     with col_stats1: st.metric("Consultas ao Mentor AI", len(st.session_state.historico_consultas))
-    with col_stats2: st.metric("Desafios Concluídos", len(st.session_state.desafios_concluidos))
+    with col_stats2: st.metric("Desafios Concluídos", st.session_state.total_desafios_concluidos)
     with col_stats3: st.metric("Metas Definidas", len(st.session_state.dados_financeiros.get("metas", {})))
     
     st.markdown("--- \n### Próximas Conquistas Sugeridas")
-    sugestoes_conq = [
-        "Complete 3 desafios de dificuldade 'Média' ou 'Difícil' 🎯",
-        "Atinja o Nível 5 de experiência 🌟",
-        "Mantenha o comprometimento de renda abaixo de 60% por um mês 💰",
-        "Construa uma reserva de emergência para 1 mês de despesas 🛡️",
-        "Aprenda 5 novos termos no glossário financeiro 📚"
-    ]
-    for sug_conq in sugestoes_conq:
-        ja_tem = any(sug_conq_base in c_atual for c_atual in st.session_state.conquistas for sug_conq_base in [sug_conq.split(' ')[-2]]) # Heurística simples
-        if not ja_tem: st.markdown(f"- {sug_conq}")
+    for regra in REGRAS_CONQUISTAS:
+        if "sugestao" not in regra: continue
+        estado = obter_progresso_regra(regra)
+        if not estado["desbloqueada"]:
+            st.markdown(f"- {regra['sugestao']} ({round(estado['valor'], 1)}/{estado['meta']})")
 
 # --- Função Principal ---
 def main():
-    inicializar_sessao()
-    exibir_cabecalho() # Exibe antes da sidebar para consistência
-    exibir_barra_lateral() # A navegação aqui pode chamar st.rerun()
+    with sessao_em_uso():
+        reidratar_sessao()
+        inicializar_sessao()
+        for desafio_expirado in processar_desafios_expirados():
+            st.toast(f"⌛ O prazo do desafio '{desafio_expirado.titulo}' terminou.")
+        exibir_cabecalho() # Exibe antes da sidebar para consistência
+        exibir_barra_lateral() # A navegação aqui pode chamar st.rerun()
     
-    # Roteamento de páginas
-    if st.session_state.pagina_atual == "boas_vindas": pagina_boas_vindas()
-    elif st.session_state.pagina_atual == "dashboard": pagina_dashboard()
-    elif st.session_state.pagina_atual == "consultor": pagina_consultor()
-    elif st.session_state.pagina_atual == "diagnostico": pagina_diagnostico()
-    elif st.session_state.pagina_atual == "desafios": pagina_desafios()
-    elif st.session_state.pagina_atual == "educacional": pagina_educacional()
-    elif st.session_state.pagina_atual == "conquistas": pagina_conquistas()
-    else: st.session_state.pagina_atual = "boas_vindas"; st.rerun() # Fallback
+        # Roteamento de páginas
+        if st.session_state.pagina_atual == "boas_vindas": pagina_boas_vindas()
+        elif st.session_state.pagina_atual == "dashboard": pagina_dashboard()
+        elif st.session_state.pagina_atual == "consultor": pagina_consultor()
+        elif st.session_state.pagina_atual == "diagnostico": pagina_diagnostico()
+        elif st.session_state.pagina_atual == "desafios": pagina_desafios()
+        elif st.session_state.pagina_atual == "educacional": pagina_educacional()
+        elif st.session_state.pagina_atual == "conquistas": pagina_conquistas()
+        else: st.session_state.pagina_atual = "boas_vindas"; st.rerun() # Fallback
 
 if __name__ == "__main__":
     main()
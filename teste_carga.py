@@ -0,0 +1,235 @@
+# Mentor Financeiro AI - Teste de Carga
+# Sobe UM servidor Streamlit local (o mesmo `streamlit run` de produção) com o Gemini
+# trocado por um modelo simulado, e conecta vários usuários "sem navegador" pelo
+# websocket do Streamlit. Cada usuário percorre um fluxo real
+# (boas-vindas -> diagnóstico -> dashboard -> consultor -> desafios) e cada rerun
+# é cronometrado. Não usa rede externa: tudo roda em 127.0.0.1.
+#
+# Uso: python teste_carga.py --sessoes 20 --repeticoes 3 --despesas 30 --dividas 10
+
+import argparse  # Para ler as opções da linha de comando
+import asyncio  # Para conduzir várias sessões ao mesmo tempo em um só processo
+import os  # Para variáveis de ambiente e caminhos
+import socket  # Para escolher uma porta livre
+import subprocess  # Para subir o servidor Streamlit
+import sys  # Para reaproveitar o mesmo interpretador no servidor
+import tempfile  # Para isolar cache, históricos e log do teste
+import time  # Para medir as latências
+import urllib.request  # Para esperar o servidor ficar pronto
+from collections import defaultdict  # Para agrupar latências por página
+
+import numpy as np  # Para os percentis
+
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MentorFinanceiroIA.py")
+
+# --- Lado do servidor: Streamlit real com o Gemini simulado ---
+
+class RespostaSimulada:
+    def __init__(self, texto):
+        self.text = texto
+
+class ModeloSimulado:
+    """Substitui genai.GenerativeModel: responde depois de `latencia` segundos, sem acessar a rede."""
+    latencia = 0.5
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(ModeloSimulado.latencia)
+        return RespostaSimulada(f"**Resposta simulada** para: {str(prompt)[:80]}...")
+
+def servir(porta, latencia_ia):
+    # Roda dentro do subprocesso: troca o modelo e entrega o controle ao `streamlit run`
+    import google.generativeai as genai
+    from streamlit.web import cli
+    genai.GenerativeModel = ModeloSimulado
+    ModeloSimulado.latencia = latencia_ia
+    sys.argv = ["streamlit", "run", CAMINHO_APP, "--server.headless", "true", "--server.port", str(porta),
+                "--server.address", "127.0.0.1", "--server.fileWatcherType", "none",
+                "--browser.gatherUsageStats", "false", "--global.developmentMode", "false"]
+    cli.main()
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def subir_servidor(args, diretorio):
+    porta = porta_livre()
+    ambiente = dict(os.environ, GOOGLE_API_KEY="chave-teste-carga", MENTOR_DADOS_DIR=os.path.join(diretorio, "dados"))
+    log = open(os.path.join(diretorio, "servidor.log"), "wb")
+    processo = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--servir", str(porta), "--latencia-ia", str(args.latencia_ia)],
+                                env=ambiente, stdout=log, stderr=subprocess.STDOUT)
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None: raise RuntimeError(f"Servidor encerrou ao iniciar; veja {log.name}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{porta}/_stcore/health", timeout=1) as resposta:
+                if resposta.status == 200: return processo, porta
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError(f"Servidor não respondeu em 60s; veja {log.name}")
+
+def ler_memoria_residente_mb(pid):
+    # VmRSS do processo do servidor (Linux)
+    with open(f"/proc/{pid}/status") as arquivo:
+        for linha in arquivo:
+            if linha.startswith("VmRSS:"): return int(linha.split()[1]) / 1024
+    return 0.0
+
+# --- Lado do cliente: um "navegador" mínimo falando o protocolo do Streamlit ---
+
+class SessaoSimulada:
+    """Um usuário conectado ao servidor; cada rerun é cronometrado e atribuído a uma página."""
+    def __init__(self, indice, args, porta, latencias):
+        self.indice = indice
+        self.args = args
+        self.url = f"ws://127.0.0.1:{porta}/_stcore/stream"
+        self.latencias = latencias
+        self.estados = {}  # id do widget -> WidgetState, reenviados a cada rerun como o navegador faz
+        self.elementos = []  # (tipo, proto) dos elementos desenhados no último rerun
+
+    async def rodar(self, pagina, gatilho=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        mensagem = BackMsg()
+        mensagem.rerun_script.widget_states.widgets.extend(self.estados.values())
+        if gatilho is not None:
+            estado = mensagem.rerun_script.widget_states.widgets.add()
+            estado.id = gatilho.id; estado.trigger_value = True
+        inicio = time.perf_counter()
+        await self.conexao.send(mensagem.SerializeToString())
+        elementos = []; erros = []
+        while True:
+            recebida = ForwardMsg()
+            recebida.ParseFromString(await asyncio.wait_for(self.conexao.recv(), self.args.tempo_limite))
+            tipo = recebida.WhichOneof("type")
+            if tipo == "new_session":
+                elementos = []  # Começou um rerun novo (ex.: st.rerun() do app)
+            elif tipo == "delta" and recebida.delta.WhichOneof("type") == "new_element":
+                elemento = recebida.delta.new_element
+                tipo_elemento = elemento.WhichOneof("type")
+                elementos.append((tipo_elemento, getattr(elemento, tipo_elemento)))
+                if tipo_elemento == "exception": erros.append(elemento.exception.message)
+            elif tipo == "script_finished" and recebida.script_finished in (
+                    ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR):
+                break
+        self.latencias[pagina].append(time.perf_counter() - inicio)
+        self.elementos = elementos
+        if erros: raise RuntimeError(f"Erro na página '{pagina}': {erros[0]}")
+
+    def buscar(self, chave=None, rotulo=None, prefixo=None):
+        for _, proto in self.elementos:
+            identificador = getattr(proto, "id", "")
+            if ((chave and identificador.endswith(f"-{chave}")) or (prefixo and f"-{prefixo}" in identificador)
+                    or (rotulo and getattr(proto, "label", None) == rotulo)):
+                return proto
+        return None
+
+    def preencher(self, valor, **busca):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        proto = self.buscar(**busca)
+        if proto is None: raise RuntimeError(f"Widget não encontrado: {busca}")
+        estado = WidgetState(id=proto.id)
+        if isinstance(valor, str): estado.string_value = valor  # text_input, text_area e radio (opção escolhida)
+        else: estado.double_value = float(valor)
+        self.estados[proto.id] = estado
+
+    async def clicar(self, pagina, **busca):
+        proto = self.buscar(**busca)
+        if proto is None: raise RuntimeError(f"Botão não encontrado: {busca}")
+        await self.rodar(pagina, proto)
+
+    async def navegar(self, pagina):
+        await self.clicar(pagina, chave=f"btn_nav_{pagina}")
+
+    async def fluxo_completo(self, repeticao):
+        await self.rodar("boas_vindas")
+        if self.buscar(chave="input_nome_boas_vindas"):
+            self.preencher(f"Usuário {self.indice}", chave="input_nome_boas_vindas")
+            await self.clicar("boas_vindas", chave="btn_comecar_jornada")
+
+        await self.navegar("diagnostico")
+        self.preencher(6000.0, chave="num_renda_principal")
+        self.preencher(2000.0, chave="num_reserva_emerg")
+        await self.clicar("diagnostico", chave="btn_salvar_renda_diag")
+        tipos = ["Fixa Essencial", "Variável Não Essencial"]
+        for i in range(self.args.despesas):
+            self.preencher(tipos[i % 2], chave="radio_tipo_despesa")
+            self.preencher(f"Despesa {repeticao}-{i}", chave="input_cat_despesa")
+            self.preencher(20.0 + i, chave="num_valor_despesa")
+            await self.clicar("diagnostico", chave="btn_add_despesa_diag")
+        for i in range(self.args.dividas):
+            self.preencher(f"Dívida {repeticao}-{i}", rotulo="Nome/Descrição da Dívida")
+            self.preencher(1000.0 + 100 * i, rotulo="Valor Total da Dívida (R$)")
+            self.preencher(150.0, rotulo="Valor da Parcela Mensal (R$)")
+            self.preencher(2.0 + i % 5, rotulo="Taxa de Juros Mensal (%)")
+            await self.clicar("diagnostico", rotulo="Adicionar Dívida")
+        await self.clicar("diagnostico", chave="btn_finalizar_diag_total")
+
+        await self.navegar("dashboard")
+        await self.rodar("dashboard")
+
+        await self.navegar("consultor")
+        self.preencher(f"Quitar minhas dívidas ({self.indice}-{repeticao})", chave="text_area_preocupacao")
+        await self.clicar("consultor", chave="btn_obter_planejamento")
+        self.preencher("Selic", chave="input_termo_glossario")
+        await self.clicar("consultor", chave="btn_explicar_termo")
+
+        await self.navegar("desafios")
+        await self.clicar("desafios", chave="btn_gerar_novo_desafio")
+        if self.buscar(prefixo="aceitar_desafio_"): await self.clicar("desafios", prefixo="aceitar_desafio_")
+
+    async def executar(self):
+        from websockets.asyncio.client import connect
+        async with connect(self.url, subprotocols=["streamlit"], max_size=None) as self.conexao:
+            for repeticao in range(self.args.repeticoes): await self.fluxo_completo(repeticao)
+
+async def executar_sessoes(args, porta, latencias):
+    sessoes = [SessaoSimulada(i, args, porta, latencias) for i in range(args.sessoes)]
+    resultados = await asyncio.gather(*(sessao.executar() for sessao in sessoes), return_exceptions=True)
+    return [f"Sessão {i}: {r!r}" for i, r in enumerate(resultados) if isinstance(r, BaseException)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do Mentor Financeiro AI com sessões simultâneas e Gemini simulado.")
+    parser.add_argument("--sessoes", type=int, default=10, help="Sessões (usuários) simultâneas")
+    parser.add_argument("--repeticoes", type=int, default=2, help="Quantas vezes cada sessão repete o fluxo")
+    parser.add_argument("--despesas", type=int, default=10, help="Despesas cadastradas por repetição")
+    parser.add_argument("--dividas", type=int, default=3, help="Dívidas cadastradas por repetição")
+    parser.add_argument("--latencia-ia", type=float, default=0.5, help="Tempo de resposta do Gemini simulado (s)")
+    parser.add_argument("--tempo-limite", type=float, default=60, help="Tempo máximo de cada rerun (s)")
+    parser.add_argument("--servir", type=int, help=argparse.SUPPRESS)  # Uso interno: porta do servidor
+    args = parser.parse_args()
+    if args.servir: return servir(args.servir, args.latencia_ia)
+
+    diretorio = tempfile.mkdtemp(prefix="mentor_carga_")
+    processo, porta = subir_servidor(args, diretorio)
+    try:
+        memoria_inicial = ler_memoria_residente_mb(processo.pid)
+        latencias = defaultdict(list)
+        inicio = time.perf_counter()
+        erros = asyncio.run(executar_sessoes(args, porta, latencias))
+        duracao = time.perf_counter() - inicio
+        memoria_final = ler_memoria_residente_mb(processo.pid)
+    finally:
+        processo.terminate()
+        try: processo.wait(timeout=10)
+        except subprocess.TimeoutExpired: processo.kill()
+
+    total_reruns = sum(len(valores) for valores in latencias.values())
+    print(f"\nSessões: {args.sessoes} | Repetições: {args.repeticoes} | Despesas: {args.despesas} | Dívidas: {args.dividas} | Latência IA: {args.latencia_ia}s")
+    print(f"Duração: {duracao:.1f}s | Reruns: {total_reruns} | Vazão: {total_reruns / duracao:.1f} reruns/s")
+    print(f"Memória residente do servidor: {memoria_inicial:.0f} MB -> {memoria_final:.0f} MB (+{memoria_final - memoria_inicial:.0f} MB)")
+    print(f"\n{'Página':<14}{'Reruns':>8}{'p50 (ms)':>11}{'p90 (ms)':>11}{'p99 (ms)':>11}{'máx (ms)':>11}")
+    for pagina, valores in sorted(latencias.items()):
+        p50, p90, p99 = np.percentile(valores, [50, 90, 99]) * 1000
+        print(f"{pagina:<14}{len(valores):>8}{p50:>11.0f}{p90:>11.0f}{p99:>11.0f}{max(valores) * 1000:>11.0f}")
+    if erros:
+        print(f"\n{len(erros)} sessão(ões) com erro (log do servidor: {os.path.join(diretorio, 'servidor.log')}):")
+        for erro in erros: print(f"- {erro}")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()